@@ -0,0 +1,42 @@
+# baseline_parser.py
+"""The record reading part of Zone.parse_zone_file() as it was before the
+parser was rewritten, kept so the tests can check the new parser against it.
+It returns the raw lines of the records of each type, keyed by record type."""
+
+import re
+
+record_searches = [
+    ('A', r"\s+in\s+a\s+"), ('AAAA', r"\s+in\s+aaaa\s+"),
+    ('CNAME', r"\s+in\s+cname\s+"), ('HINFO', r"\s+in\s+hinfo\s+"),
+    ('MX', r"\s+in\s+mx\s+"), ('NS', r"\s+in\s+ns\s+"),
+    ('PTR', r"\s+in\s+ptr\s+"), ('SRV', r"\s+in\s+srv\s+"),
+    ('TXT', r"\s+in\s+txt\s+")
+]
+
+def parse_records(zoneFile):
+    "Return a dict of record type to the raw lines of those records in zoneFile."
+    
+    records = {}
+    for (rr_type, rgxp) in record_searches:
+        records[rr_type] = []
+    zf = open(zoneFile, 'r')
+    # Find the end of the SOA, the records follow it
+    zf.seek(0,2)
+    endPos = zf.tell()
+    zf.seek(0)
+    while zf.tell() < endPos:
+        line = zf.readline()
+        lineEnd = zf.tell()
+        if line.find(')') > -1:
+            soaEnd = lineEnd
+            break
+    zf.seek(soaEnd)
+    rrTmp = zf.read()
+    zf.close()
+    for rr in rrTmp.split('\n'):
+        for (rr_type, rgxp) in record_searches:
+            if re.search(rgxp, rr, re.IGNORECASE):
+                records[rr_type].append(rr)
+                break
+    
+    return records
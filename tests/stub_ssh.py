@@ -0,0 +1,38 @@
+# stub_ssh.py
+"""Stands in for ssh in the replication tests: 'stub_ssh.py [options] HOST
+COMMAND'. Each call is logged to $STUB_SSH_LOG/calls as 'HOST<tab>COMMAND', and
+its standard input kept as $STUB_SSH_LOG/HOST.N.in. Hosts listed (comma
+separated) in $STUB_SSH_FAIL can't be reached. For a receive command, the tar
+archive on standard input is read, and on hosts listed in $STUB_SSH_STALE every
+journal in it is reported stale, as a nameserver without the old zone file would.
+"""
+
+import os
+import sys
+import tarfile
+
+log_dir = os.environ['STUB_SSH_LOG']
+(host, command) = sys.argv[-2:]
+
+f = open(os.path.join(log_dir, 'calls'), 'a')
+f.write('%s\t%s\n' % (host, command))
+f.close()
+calls = [name for name in os.listdir(log_dir) if name.startswith(host + '.')]
+input_file = os.path.join(log_dir, '%s.%d.in' % (host, len(calls)))
+f = open(input_file, 'wb')
+f.write(sys.stdin.read())
+f.close()
+
+if host in os.environ.get('STUB_SSH_FAIL', '').split(','):
+    sys.stderr.write('ssh: connect to host %s port 22: Connection refused\n' % host)
+    sys.exit(255)
+
+if 'receive' in command.split():
+    tar = tarfile.open(input_file)
+    for member in tar.getmembers():
+        if member.name.endswith('.jnl') and host in os.environ.get('STUB_SSH_STALE', '').split(','):
+            print 'stale %s.' % member.name[0:-4]
+    tar.close()
+    print '%s: received' % host
+else:
+    print '%s: ran %s' % (host, command)
@@ -0,0 +1,73 @@
+# support.py
+"""Shared set up for the tests: puts the repo's modules on the path, loads the
+dnsadmin script as a module and makes temporary trees of files."""
+
+import imp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.dont_write_bytecode = True
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+zones_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'zones')
+if repo_dir not in sys.path:
+    sys.path.insert(0, repo_dir)
+
+import zone
+
+_dnsadmin = []
+
+def load_dnsadmin():
+    "Return the dnsadmin script, loaded as a module (once)."
+    
+    if not _dnsadmin:
+        _dnsadmin.append(imp.load_source('dnsadmin_under_test', os.path.join(repo_dir, 'dnsadmin')))
+    
+    return _dnsadmin[0]
+
+def write_file(path, text):
+    "Write text out to path, making its directory if need be."
+    
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    f = open(path, 'w')
+    f.write(text)
+    f.close()
+
+def read_file(path):
+    "Return the contents of path."
+    
+    f = open(path, 'r')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def zone_text(name, records, serial='2026101801'):
+    "Return the text of a zone file for name holding the given record lines."
+    
+    return '''$TTL 1h
+%s.\tIN SOA ns1.%s. hostmaster.%s. (
+    %s  ; serial
+    3h  ; refresh
+    1h  ; retry
+    1w  ; expiration
+    1h  ; minimum ttl
+    )
+%s
+''' % (name, name, name, serial, '\n'.join(records))
+
+
+class TempDirTestCase(unittest.TestCase):
+    "A test case with a temporary directory (self.dir), removed afterwards."
+    
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix='dnsadmin-test.')
+    
+    def tearDown(self):
+        shutil.rmtree(self.dir, True)
+    
+    def path(self, *names):
+        return os.path.join(self.dir, *names)
@@ -0,0 +1,104 @@
+# test_generate.py
+"Tests for $GENERATE ranges."
+
+import unittest
+
+import zone
+
+def a_record(src, tgt):
+    rr = zone.A()
+    rr.src = src
+    rr.tgt = tgt
+    return rr
+
+def records(rng):
+    return [(rr.src, rr.rrtype, rr.tgt) for rr in rng.records()]
+
+
+class GenerateRangeTest(unittest.TestCase):
+    
+    def test_parse(self):
+        rng = zone.new_generate_range('$GENERATE 1-10/2 host-$ 300 IN A 10.0.0.$\n')
+        self.assertEqual((rng.start, rng.stop, rng.step, rng.lhs, rng.ttl, rng.rrclass, rng.rr_type, rng.rhs),
+                         (1, 10, 2, 'host-$', '300', 'IN', 'A', '10.0.0.$'))
+        self.assertEqual(rng.text, None)
+        self.assertEqual(rng.out(), '$GENERATE 1-10/2 host-$ 300 IN A 10.0.0.$')
+        self.assertEqual(list(rng.values()), [1, 3, 5, 7, 9])
+        # The class can come before the TTL, and is written out after it
+        rng = zone.new_generate_range('$GENERATE 1-2 $ in 300 PTR h$.example.com.')
+        self.assertEqual((rng.ttl, rng.rrclass, rng.rr_type), ('300', 'IN', 'PTR'))
+    
+    def test_text_kept(self):
+        line = '$GENERATE 1-3 h$ IN A 10.0.0.$ ; hosts'
+        rng = zone.new_generate_range(line + '\n')
+        self.assertEqual(rng.out(), line)
+        self.assertEqual(len(records(rng)), 3)
+        # A line we can't make sense of stands for nothing, but is kept
+        rng = zone.new_generate_range('$GENERATE lots h$ IN A 10.0.0.$\n')
+        self.assertEqual((records(rng), rng.out()), ([], '$GENERATE lots h$ IN A 10.0.0.$'))
+    
+    def test_records(self):
+        rng = zone.new_generate_range('$GENERATE 8-10 ${0,3,d}-\\$ IN CNAME host${-8,2,x}.example.com.')
+        self.assertEqual(records(rng), [
+            ('008-$', 'CNAME', 'host00.example.com.'), ('009-$', 'CNAME', 'host01.example.com.'),
+            ('010-$', 'CNAME', 'host02.example.com.')
+        ])
+        # Types we don't keep, and modifiers we don't know, stand for nothing
+        self.assertEqual(records(zone.new_generate_range('$GENERATE 1-3 h$ IN TXT "$"')), [])
+        self.assertEqual(records(zone.new_generate_range('$GENERATE 1-3 h${0,1,n} IN A 10.0.0.$')), [])
+    
+    def test_without(self):
+        rng = zone.GenerateRange(1, 10, 'h$', 'A', '10.0.0.$')
+        self.assertEqual([(r.start, r.stop) for r in rng.without({1: True, 5: True, 6: True})],
+                         [(2, 4), (7, 10)])
+        self.assertEqual(rng.without(dict([(x, True) for x in range(1, 11)])), [])
+    
+    def test_key(self):
+        self.assertEqual(zone.GenerateRange(1, 10, 'h$', 'A', '10.0.0.$').key(),
+                         ('A', 'h$', '10.0.0.$', '', 'IN'))
+        self.assertEqual(zone.GenerateRange(1, 10, 'h$', 'A', '10.0.0.$', step=2).key(), None)
+        self.assertEqual(zone.GenerateRange(1, 10, 'h${1}', 'A', '10.0.0.$').key(), None)
+
+
+class ZoneRangesTest(unittest.TestCase):
+    
+    def setUp(self):
+        self.zone = zone.Zone('example.com.')
+        self.zone.generate = [zone.GenerateRange(1, 10, 'h$', 'A', '10.0.0.$')]
+    
+    def test_all_records(self):
+        self.zone.a = [a_record('www', '10.0.1.1')]
+        self.assertEqual([rr.src for rr in self.zone.all_records('a')],
+                         ['www'] + ['h%d' % x for x in range(1, 11)])
+        self.assertEqual(self.zone.a_record_ips()[0:2], ['10.0.1.1', '10.0.0.1'])
+    
+    def test_split_ranges(self):
+        self.zone.split_ranges('a', lambda rr: rr.tgt in ('10.0.0.4', '10.0.0.5'))
+        self.assertEqual([rr.src for rr in self.zone.a], ['h4', 'h5'])
+        self.assertEqual([(r.start, r.stop) for r in self.zone.generate], [(1, 3), (6, 10)])
+    
+    def test_compact_ranges(self):
+        self.zone.generate = [zone.GenerateRange(1, 3, 'h$', 'A', '10.0.0.$'),
+                              zone.GenerateRange(6, 10, 'h$', 'A', '10.0.0.$')]
+        self.zone.a = [a_record('h4', '10.0.0.4'), a_record('h5', '10.0.0.5'),
+                       a_record('www', '10.0.1.1'), a_record('h20', '10.0.0.21')]
+        self.zone.compact_ranges()
+        self.assertEqual([(r.start, r.stop) for r in self.zone.generate], [(1, 10)])
+        self.assertEqual([rr.src for rr in self.zone.a], ['www', 'h20'])
+    
+    def test_compact_new_runs(self):
+        self.zone.generate = []
+        self.zone.ptr = []
+        for x in range(1, 6):
+            rr = zone.PTR()
+            (rr.src, rr.tgt) = (str(x), 'host-%d.example.com.' % x)
+            self.zone.ptr.append(rr)
+        self.zone.compact_ranges(min_run=10)
+        self.assertEqual((len(self.zone.ptr), self.zone.generate), (5, []))
+        self.zone.compact_ranges(min_run=5)
+        self.assertEqual(self.zone.ptr, [])
+        self.assertEqual([r.out() for r in self.zone.generate], ['$GENERATE 1-5 $ IN PTR host-$.example.com.'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+# test_ip_map.py
+"Tests for IP address changes (IPMap) and finding the zones they touch (IPIndex)."
+
+import unittest
+
+from support import TempDirTestCase
+import zone
+
+
+class ParseCidrTest(unittest.TestCase):
+    
+    def test_valid(self):
+        self.assertEqual(zone.parse_cidr('10.1.2.3'), (0x0a010203, 32))
+        self.assertEqual(zone.parse_cidr('10.1.2.0/24'), (0x0a010200, 24))
+        self.assertEqual(zone.parse_cidr('0.0.0.0/0'), (0, 0))
+        self.assertEqual(zone.int_to_ip(0x0a010203), '10.1.2.3')
+    
+    def test_invalid(self):
+        for text in ('10.1.2', '10.1.2.256', '10.1.2.x', '10.1.2.0/33', '10.1.2.0/x',
+                     '10.1.2.1/24', '', 'www.example.com'):
+            self.assertRaises(ValueError, zone.parse_cidr, text)
+
+
+class IPMapTest(unittest.TestCase):
+    
+    def test_exact(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.0.0.1', '10.0.0.2')
+        self.assertEqual(ip_map.new_ip('10.0.0.1'), '10.0.0.2')
+        self.assertEqual(ip_map.new_ip('10.0.0.2'), None)
+        self.assertTrue('10.0.0.1' in ip_map)
+        self.assertEqual(len(ip_map), 1)
+    
+    def test_networks_longest_first(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.1.0.0/16', '172.16.0.0/16')
+        ip_map.add('10.1.2.0/24', '192.168.9.0/24')
+        ip_map.add('10.1.2.7', '10.9.9.9')
+        self.assertEqual(ip_map.new_ip('10.1.2.7'), '10.9.9.9')
+        self.assertEqual(ip_map.new_ip('10.1.2.8'), '192.168.9.8')
+        self.assertEqual(ip_map.new_ip('10.1.3.8'), '172.16.3.8')
+        self.assertEqual(ip_map.new_ip('10.2.3.8'), None)
+        self.assertEqual(ip_map.new_ip('not an ip'), None)
+        self.assertEqual(ip_map.lengths, [24, 16])
+    
+    def test_odd_prefix_length(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.1.2.128/25', '10.5.5.0/25')
+        self.assertEqual(ip_map.new_ip('10.1.2.200'), '10.5.5.72')
+        self.assertEqual(ip_map.new_ip('10.1.2.100'), None)
+    
+    def test_swap(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.0.0.1', '10.0.0.2')
+        ip_map.add('10.0.0.2', '10.0.0.1')
+        self.assertEqual((ip_map.new_ip('10.0.0.1'), ip_map.new_ip('10.0.0.2')), ('10.0.0.2', '10.0.0.1'))
+    
+    def test_bad_rules(self):
+        ip_map = zone.IPMap()
+        self.assertRaises(ValueError, ip_map.add, '10.1.2.0/24', '10.1.0.0/16')
+        self.assertRaises(ValueError, ip_map.add, '10.1.2.0/24', '10.1.3.1')
+        self.assertRaises(ValueError, ip_map.add, '10.1.2', '10.1.3.1')
+        ip_map.add('10.0.0.1', '10.0.0.2')
+        ip_map.add('10.0.0.1', '10.0.0.2')
+        self.assertRaises(ValueError, ip_map.add, '10.0.0.1', '10.0.0.3')
+        ip_map.add('10.1.0.0/16', '10.2.0.0/16')
+        self.assertRaises(ValueError, ip_map.add, '10.1.0.0/16', '10.3.0.0/16')
+    
+    def test_index_prefixes(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.0.0.1', '10.0.0.2')
+        ip_map.add('10.1.0.0/16', '10.2.0.0/16')
+        ip_map.add('10.3.4.0/23', '10.5.6.0/23')
+        self.assertEqual(sorted(ip_map.index_prefixes()), ['10.0.0.1', '10.1.', '10.3.4.', '10.3.5.'])
+
+
+class IPIndexTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.index = zone.IPIndex(self.path('ip_index.db'))
+        self.index.index_zone('a.com.', ['10.1.2.3', '10.1.20.1'])
+        self.index.index_zone('b.com.', ['10.1.2.99', '10.10.0.1'])
+        self.index.index_zone('c.com.', ['10.1.3.1'])
+    
+    def tearDown(self):
+        self.index.close()
+        TempDirTestCase.tearDown(self)
+    
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('10.1.2.3'), ['a.com.'])
+        self.assertEqual(self.index.lookup('10.1.2.4'), [])
+    
+    def test_lookup_prefix(self):
+        # '10.1.2.' mustn't match 10.1.20.1
+        self.assertEqual(self.index.lookup_prefix('10.1.2.'), ['a.com.', 'b.com.'])
+        self.assertEqual(self.index.lookup_prefix('10.1.'), ['a.com.', 'b.com.', 'c.com.'])
+        self.assertEqual(self.index.lookup_prefix('10.10.'), ['b.com.'])
+        self.assertEqual(self.index.lookup_prefix(''), ['a.com.', 'b.com.', 'c.com.'])
+    
+    def test_network_change_finds_zones(self):
+        ip_map = zone.IPMap()
+        ip_map.add('10.1.2.0/23', '10.7.2.0/23')
+        zones = {}
+        for prefix in ip_map.index_prefixes():
+            for zone_name in self.index.lookup_prefix(prefix):
+                zones[zone_name] = True
+        self.assertEqual(sorted(zones.keys()), ['a.com.', 'b.com.', 'c.com.'])
+    
+    def test_reindex_and_remove(self):
+        self.index.index_zone('a.com.', ['10.9.9.9'])
+        self.assertEqual(self.index.lookup('10.1.2.3'), [])
+        self.index.zone_removed('b.com.')
+        self.assertEqual(self.index.lookup_prefix('10.1.2.'), [])
+        self.assertFalse(self.index.is_built())
+        self.index.set_built()
+        self.assertTrue(self.index.is_built())
+        self.index.clear()
+        self.assertFalse(self.index.is_built())
+        self.assertEqual(self.index.lookup_prefix(''), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
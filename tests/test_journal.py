@@ -0,0 +1,100 @@
+# test_journal.py
+"Tests for zone journals: diffs, patches and the journal files."
+
+import hashlib
+import os
+import unittest
+
+from support import TempDirTestCase, load_dnsadmin, write_file, zone_text
+import zone
+
+
+class DiffTest(unittest.TestCase):
+    
+    def round_trip(self, old_lines, new_lines):
+        (removed, added) = zone.diff_lines(old_lines, new_lines)
+        self.assertEqual(zone.patch_lines(old_lines, removed, added), new_lines)
+        return (removed, added)
+    
+    def test_change(self):
+        (removed, added) = self.round_trip(['a', 'b', 'c', 'd'], ['a', 'x', 'c', 'd', 'e'])
+        self.assertEqual(removed, ['b'])
+        self.assertEqual(added, [(1, 'x'), (4, 'e')])
+    
+    def test_duplicates_and_empty(self):
+        self.round_trip(['a', 'a', 'b', ''], ['a', 'b', 'b', ''])
+        self.round_trip([], ['a'])
+        self.round_trip(['a'], [])
+        self.assertEqual(zone.diff_lines(['a', 'b'], ['a', 'b']), ([], []))
+    
+    def test_serial_of(self):
+        self.assertEqual(zone.serial_of(zone_text('a.com', [], '2026101805')), '2026101805')
+        self.assertEqual(zone.serial_of('www IN A 10.0.0.1\n'), '-')
+
+
+class ZoneJournalTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.journal = zone.ZoneJournal(self.path('journal'))
+        self.versions = []
+        for serial in range(1, 4):
+            records = ['www IN A 10.0.0.%d' % serial, 'mail IN A 10.0.1.1']
+            self.versions.append(zone_text('a.com', records, '202610180%d' % serial))
+        for x in range(1, len(self.versions)):
+            self.journal.record('a.com.', self.versions[x-1], self.versions[x])
+    
+    def sha1(self, x):
+        return hashlib.sha1(self.versions[x]).hexdigest()
+    
+    def test_entries(self):
+        entries = self.journal.entries('a.com.')
+        self.assertEqual(len(entries), 2)
+        self.assertEqual((entries[0]['old_serial'], entries[0]['new_serial']), ('2026101801', '2026101802'))
+        self.assertEqual((entries[0]['old_hash'], entries[0]['new_hash']), (self.sha1(0), self.sha1(1)))
+        self.assertFalse(entries[0]['full'])
+        # The text of each entry reads back as the same entry
+        self.assertEqual(zone.parse_journal(entries[1]['text'].splitlines(True))[0]['added'],
+                         entries[1]['added'])
+    
+    def test_entries_between(self):
+        chain = self.journal.entries_between('a.com.', self.sha1(0), self.sha1(2))
+        self.assertEqual([entry['new_serial'] for entry in chain], ['2026101802', '2026101803'])
+        chain = self.journal.entries_between('a.com.', self.sha1(1), self.sha1(2))
+        self.assertEqual(len(chain), 1)
+        self.assertEqual(self.journal.entries_between('a.com.', 'unknown', self.sha1(2)), None)
+        self.assertEqual(self.journal.entries_between('b.com.', self.sha1(0), self.sha1(2)), None)
+    
+    def test_full_entry_breaks_chain(self):
+        self.journal.record_diff('a.com.', '2026101803', '2026101804', self.sha1(2), 'new', None, None)
+        self.assertTrue(self.journal.entries('a.com.')[-1]['full'])
+        self.assertEqual(self.journal.entries_between('a.com.', self.sha1(0), 'new'), None)
+    
+    def test_apply_journal(self):
+        dnsadmin = load_dnsadmin()
+        zone_file = self.path('zones', 'a.com')
+        write_file(zone_file, self.versions[0])
+        text = ''.join([entry['text'] for entry in self.journal.entries('a.com.')])
+        self.assertEqual(dnsadmin.apply_journal(zone_file, text), self.versions[2])
+        # A journal that doesn't start from the file we have can't be used
+        write_file(zone_file, self.versions[1] + '; edited\n')
+        self.assertEqual(dnsadmin.apply_journal(zone_file, text), None)
+        self.assertEqual(dnsadmin.apply_journal(self.path('zones', 'missing'), text), None)
+    
+    def test_trim(self):
+        journal = zone.ZoneJournal(self.path('small'), max_size=600)
+        for x in range(20):
+            journal.record('a.com.', self.versions[x % 2], self.versions[(x + 1) % 2])
+        self.assertTrue(os.path.getsize(journal.journal_file('a.com.')) <= 600)
+        entries = journal.entries('a.com.')
+        self.assertTrue(len(entries) > 0)
+        self.assertEqual(entries[-1]['new_hash'], self.sha1(0))
+    
+    def test_remove(self):
+        self.journal.remove('a.com.')
+        self.assertEqual(self.journal.entries('a.com.'), [])
+        self.journal.remove('a.com.')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,83 @@
+# test_layout.py
+"Tests for where zone files go, and moving them between layouts."
+
+import errno
+import hashlib
+import os
+import unittest
+from ConfigParser import ConfigParser
+
+from support import TempDirTestCase, load_dnsadmin, read_file, write_file, zone_text
+
+
+class LayoutTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.dnsadmin = load_dnsadmin()
+        self.zone_path = self.path('zones') + '/'
+        self.conf_path = self.path('named.conf')
+        self.conf = ConfigParser()
+        self.conf.add_section('bind')
+        self.conf.set('bind', 'zonefile_path', self.zone_path)
+        self.conf.set('bind', 'zonefile_format', '%.zone')
+        self.conf.set('bind', 'conf_path', self.conf_path)
+        self.zone_names = ['a.com', 'b.com', 'c.net']
+        for zone_name in self.zone_names:
+            write_file(self.path('zones', zone_name + '.zone'), zone_text(zone_name, []))
+        self.conf_text = ''.join([
+            'zone "a.com" { type master; file "a.com.zone"; };\n',
+            'zone "b.com" {\n    type master;\n    file "%s";\n};\n' % self.path('zones', 'b.com.zone'),
+            'zone "c.net" { type master; file "c.net.zone"; };\n',
+            'zone "other.org" { type master; file "elsewhere/other.org.zone"; };\n'
+        ])
+        write_file(self.conf_path, self.conf_text)
+    
+    def hashed_name(self, zone_name):
+        digest = hashlib.md5(zone_name).hexdigest()
+        return os.path.join(digest[0:2], digest[2:4], zone_name + '.zone')
+    
+    def test_zone_file_name(self):
+        self.assertEqual(self.dnsadmin.zone_file_name('a.com.', self.conf), 'a.com.zone')
+        self.assertEqual(self.dnsadmin.zone_file_name('a.com.', self.conf, 'hashed'),
+                         self.hashed_name('a.com'))
+        # The directories don't depend on the case of the zone name
+        self.assertEqual(os.path.dirname(self.dnsadmin.zone_file_name('A.com.', self.conf, 'hashed')),
+                         os.path.dirname(self.hashed_name('a.com')))
+        self.conf.set('bind', 'zonefile_layout', 'hashed')
+        self.assertEqual(self.dnsadmin.zone_file_path('c.net.', self.conf),
+                         self.zone_path + self.hashed_name('c.net'))
+    
+    def test_migrate_to_hashed_and_back(self):
+        self.conf.set('bind', 'zonefile_layout', 'hashed')
+        self.assertEqual(self.dnsadmin.migrate_layout(self.conf), 3)
+        for zone_name in self.zone_names:
+            self.assertTrue(os.path.isfile(self.path('zones', self.hashed_name(zone_name))))
+            self.assertFalse(os.path.exists(self.path('zones', zone_name + '.zone')))
+        self.assertEqual(read_file(self.conf_path), self.conf_text
+                         .replace('"a.com.zone"', '"%s"' % self.hashed_name('a.com'))
+                         .replace(self.path('zones', 'b.com.zone'), self.path('zones', self.hashed_name('b.com')))
+                         .replace('"c.net.zone"', '"%s"' % self.hashed_name('c.net')))
+        # Running it again has nothing left to do
+        self.assertEqual(self.dnsadmin.migrate_layout(self.conf), 0)
+        
+        self.conf.set('bind', 'zonefile_layout', 'flat')
+        self.assertEqual(self.dnsadmin.migrate_layout(self.conf), 3)
+        self.assertEqual(sorted(os.listdir(self.path('zones'))), [zone_name + '.zone' for zone_name in self.zone_names])
+        self.assertEqual(read_file(self.conf_path), self.conf_text)
+    
+    def test_file_in_the_way(self):
+        self.conf.set('bind', 'zonefile_layout', 'hashed')
+        write_file(self.path('zones', self.hashed_name('a.com')), 'in the way\n')
+        try:
+            self.dnsadmin.migrate_layout(self.conf)
+        except OSError, e:
+            self.assertEqual(e.errno, errno.EEXIST)
+        else:
+            self.fail('migrate_layout() moved a zone file over another')
+        self.assertTrue(os.path.isfile(self.path('zones', 'a.com.zone')))
+        self.assertEqual(read_file(self.conf_path), self.conf_text)
+
+
+if __name__ == '__main__':
+    unittest.main()
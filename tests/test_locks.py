@@ -0,0 +1,85 @@
+# test_locks.py
+"Tests for the zone and named.conf locks shared between dnsadmin processes."
+
+import os
+import subprocess
+import sys
+import time
+import unittest
+
+from support import TempDirTestCase
+import zone
+
+# Holds the lock file given for half a second, in a process of its own
+hold_lock = '''import fcntl, os, sys, time
+fd = os.open(sys.argv[1], os.O_RDWR | os.O_CREAT)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print 'locked'
+sys.stdout.flush()
+time.sleep(0.5)
+'''
+
+
+class ZoneLocksTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.locks = zone.ZoneLocks(self.path('locks'), timeout=0.2)
+        # Another dnsadmin, as far as the locks are concerned
+        self.other = zone.ZoneLocks(self.path('locks'), timeout=0.2)
+    
+    def tearDown(self):
+        self.locks.release_all()
+        self.other.release_all()
+        TempDirTestCase.tearDown(self)
+    
+    def test_exclusive(self):
+        self.locks.lock_zones(['b.com.', 'a.com.'])
+        self.assertEqual(sorted(self.locks.held.keys()), ['a.com.', 'b.com.'])
+        # Taking a lock we hold again is fine
+        self.locks.acquire('a.com.')
+        started = time.time()
+        self.assertRaises(IOError, self.other.acquire, 'b.com.')
+        self.assertTrue(time.time() - started >= 0.2)
+        self.other.acquire('c.com.')
+        
+        self.locks.release('b.com.')
+        self.other.acquire('b.com.')
+        self.assertEqual(sorted(self.other.held.keys()), ['b.com.', 'c.com.'])
+    
+    def test_conf_lock(self):
+        self.locks.lock_conf()
+        self.other.acquire('named.conf.')
+        self.assertRaises(IOError, self.other.lock_conf)
+        self.locks.unlock_conf()
+        self.other.lock_conf()
+    
+    def test_release_all(self):
+        self.locks.lock_zones(['a.com.', 'b.com.'])
+        self.locks.lock_conf()
+        self.locks.release_all()
+        self.assertEqual(self.locks.held, {})
+        self.other.lock_zones(['a.com.', 'b.com.'])
+        self.other.lock_conf()
+        self.locks.release('a.com.')
+    
+    def test_classless_reverse_zone(self):
+        self.locks.acquire('0/25.2.1.10.in-addr.arpa.')
+        self.assertTrue(os.path.isfile(self.path('locks', '0_25.2.1.10.in-addr.arpa.lock')))
+        self.assertRaises(IOError, self.other.acquire, '0/25.2.1.10.in-addr.arpa.')
+    
+    def test_waits_for_other_process(self):
+        proc = subprocess.Popen([sys.executable, '-c', hold_lock, self.path('locks', 'a.com.lock')],
+                                stdout=subprocess.PIPE)
+        try:
+            self.assertEqual(proc.stdout.readline(), 'locked\n')
+            self.locks.timeout = 10
+            started = time.time()
+            self.locks.acquire('a.com.')
+            self.assertTrue(time.time() - started >= 0.2)
+        finally:
+            proc.wait()
+
+
+if __name__ == '__main__':
+    unittest.main()
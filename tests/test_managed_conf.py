@@ -0,0 +1,128 @@
+# test_managed_conf.py
+"Tests for the sharded named.conf zone entries, and moving zones into them."
+
+import os
+import unittest
+
+from support import TempDirTestCase, load_dnsadmin, read_file, write_file
+import zone
+
+def entry(zone_name, zone_type='master'):
+    return 'zone "%s" {\n    type %s;\n    file "/var/named/%s";\n};' % (zone_name, zone_type, zone_name)
+
+
+class ManagedConfTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.conf_path = self.path('named.conf')
+        write_file(self.conf_path, entry('old.com') + '\n')
+        self.managed = zone.ManagedConf(self.path('zones'), shards=4, conf_path=self.conf_path)
+    
+    def tearDown(self):
+        self.managed.close()
+        TempDirTestCase.tearDown(self)
+    
+    def shard_text(self, zone_name):
+        return read_file(self.managed.shard_file(self.managed.shard_for(zone_name)))
+    
+    def test_include_file(self):
+        lines = read_file(self.managed.include_file).splitlines()
+        self.assertEqual(lines, ['include "%s";' % self.managed.shard_file(x) for x in range(4)])
+        for x in range(4):
+            self.assertTrue(os.path.isfile(self.managed.shard_file(x)))
+    
+    def test_chroot_include_paths(self):
+        self.managed.close()
+        self.managed = zone.ManagedConf(self.path('zones'), conf_path=self.conf_path, chroot=self.dir + '/')
+        self.assertEqual(read_file(self.managed.include_file).splitlines()[0],
+                         'include "/zones/zones-000.conf";')
+        self.assertEqual(self.managed.named_path('/elsewhere/x'), '/elsewhere/x')
+    
+    def test_shard_count_kept(self):
+        self.managed.close()
+        self.managed = zone.ManagedConf(self.path('zones'), shards=64, conf_path=self.conf_path)
+        self.assertEqual(self.managed.shards, 4)
+    
+    def test_add_and_remove(self):
+        self.assertTrue(self.managed.add_zone('a.com.', entry('a.com')))
+        self.assertTrue(self.managed.add_zone('b.com', entry('b.com')))
+        self.assertFalse(self.managed.add_zone('a.com', entry('a.com')))
+        self.assertTrue(self.managed.has_zone('a.com.'))
+        self.assertEqual(self.managed.zone_names(), ['a.com', 'b.com'])
+        self.assertEqual(self.shard_text('a.com').count('zone "a.com"'), 1)
+        
+        self.assertTrue(self.managed.remove_zone('a.com.'))
+        self.assertFalse(self.managed.remove_zone('a.com.'))
+        self.assertFalse(self.managed.has_zone('a.com'))
+        self.assertFalse('a.com' in self.shard_text('a.com'))
+        self.assertTrue(entry('b.com') in self.shard_text('b.com'))
+    
+    def test_zone_in_named_conf_not_added(self):
+        self.assertFalse(self.managed.add_zone('old.com.', entry('old.com')))
+        self.assertEqual(self.managed.add_zones([('old.com', entry('old.com')), ('new.com', entry('new.com')),
+                                                 ('new.com', entry('new.com'))]), ['new.com'])
+        self.assertEqual(self.managed.zone_names(), ['new.com'])
+        self.assertEqual(self.shard_text('new.com').count('zone "new.com"'), 1)
+        # Unless the caller says what is in named.conf
+        self.assertEqual(self.managed.add_zones([('old.com', entry('old.com'))], {}), ['old.com'])
+
+
+class MigrateConfTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.dnsadmin = load_dnsadmin()
+        self.conf_path = self.path('named.conf')
+        self.masters = ['a.com', 'b.com', 'c.net', '2.1.10.in-addr.arpa']
+        self.conf_text = '\n'.join([
+            'options {', '    directory "/var/named";', '};',
+            entry('.', 'hint'),
+            entry(self.masters[0]), entry(self.masters[1]),
+            '// a comment { with a brace',
+            entry('slave.com', 'slave'),
+            entry(self.masters[2]), entry(self.masters[3]),
+            'view "inside" {', '    ' + entry('view.com'), '};', ''
+        ])
+        write_file(self.conf_path, self.conf_text)
+        self.managed = zone.ManagedConf(self.path('zones'), shards=4, conf_path=self.conf_path)
+    
+    def tearDown(self):
+        self.managed.close()
+        TempDirTestCase.tearDown(self)
+    
+    def test_migrate(self):
+        self.assertEqual(self.dnsadmin.migrate_conf(self.conf_path, self.managed), 4)
+        self.assertEqual(self.managed.zone_names(), sorted(self.masters))
+        for zone_name in self.masters:
+            shard = read_file(self.managed.shard_file(self.managed.shard_for(zone_name)))
+            self.assertTrue(entry(zone_name) in shard, zone_name)
+        shards = ''.join([read_file(self.managed.shard_file(x)) for x in range(4)])
+        self.assertEqual(shards.count('zone "'), 4)
+        
+        self.assertEqual(read_file(self.conf_path), '\n'.join([
+            'options {', '    directory "/var/named";', '};',
+            entry('.', 'hint'),
+            '// a comment { with a brace',
+            entry('slave.com', 'slave'),
+            'view "inside" {', '    ' + entry('view.com'), '};',
+            'include "%s";' % self.managed.include_file, ''
+        ]))
+        self.assertEqual(read_file(self.conf_path + '.orig'), self.conf_text)
+        
+        # Running it again moves nothing, and doesn't add another include
+        new_text = read_file(self.conf_path)
+        self.assertEqual(self.dnsadmin.migrate_conf(self.conf_path, self.managed), 0)
+        self.assertEqual(read_file(self.conf_path), new_text)
+    
+    def test_zone_not_added_kept(self):
+        self.managed.add_zones([('b.com', entry('b.com'))], {})
+        self.assertEqual(self.dnsadmin.migrate_conf(self.conf_path, self.managed), 3)
+        conf_text = read_file(self.conf_path)
+        self.assertTrue(entry('b.com') in conf_text)
+        self.assertFalse(entry('a.com') in conf_text)
+        self.assertEqual(self.managed.zone_names(), sorted(self.masters))
+
+
+if __name__ == '__main__':
+    unittest.main()
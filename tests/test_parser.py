@@ -0,0 +1,141 @@
+# test_parser.py
+"Tests for reading zone files, against the parser dnsadmin used to have."
+
+import os
+import unittest
+
+from support import TempDirTestCase, write_file, zone_text, zones_dir
+import baseline_parser
+import zone
+
+# Record types whose data is made of names or addresses, which are compared
+# ignoring case
+name_types = ['AAAA', 'CNAME', 'MX', 'NS', 'PTR', 'SRV']
+
+def canonical(lines, rr_type):
+    """Reduce record lines to (owner, ttl, type, data) tuples, with comments and
+the layout dropped, and left out owners filled in from the line before."""
+    
+    records = []
+    owner = '@'
+    for line in lines:
+        tokens = zone.strip_comment(line).split()
+        if not line[0].isspace():
+            owner = tokens.pop(0).lower()
+        ttl = ''
+        while tokens[0].upper() != rr_type:
+            if tokens[0].upper() != 'IN':
+                ttl = tokens[0]
+            tokens.pop(0)
+        data = ' '.join(tokens[1:])
+        if rr_type in name_types:
+            data = data.lower()
+        records.append((owner, ttl, rr_type, data))
+    
+    return records
+
+def parsed_records(zone_file, name):
+    "Return the records the new parser reads from zone_file, by record type."
+    
+    z = zone.Zone(name)
+    z.zone_file = zone_file
+    z.parse_zone_file()
+    records = {}
+    for (rr_type, rgxp) in baseline_parser.record_searches:
+        rr_list = getattr(z, rr_type.lower())
+        records[rr_type] = canonical([rr.out() for rr in rr_list], rr_type)
+    
+    return (z, records)
+
+
+class BaselineTest(unittest.TestCase):
+    "The new parser reads the same records as the old one did."
+    
+    def test_plain_zone(self):
+        zone_file = os.path.join(zones_dir, 'plain.zone')
+        old = baseline_parser.parse_records(zone_file)
+        (z, new) = parsed_records(zone_file, 'plain.com.')
+        for (rr_type, rgxp) in baseline_parser.record_searches:
+            self.assertEqual(canonical(old[rr_type], rr_type), new[rr_type], rr_type)
+        self.assertEqual(len(new['A']), 3)
+        self.assertEqual(z.soa['serial'], '2026101801')
+        self.assertEqual(z.soa['ttl'], '1h')
+    
+    def test_intended_differences(self):
+        zone_file = os.path.join(zones_dir, 'directives.zone')
+        old = baseline_parser.parse_records(zone_file)
+        (z, new) = parsed_records(zone_file, 'dir.com.')
+        # A multi-line record keeps all its data, not just its first line
+        self.assertEqual(canonical(old['TXT'], 'TXT'), [('dkim', '', 'TXT', '( "part one"')])
+        self.assertEqual(new['TXT'], [('dkim', '', 'TXT', '"part one" "part two"')])
+        # Owners below an $ORIGIN are qualified, and a $GENERATE range is kept
+        # as a range rather than among the A records
+        self.assertEqual(canonical(old['A'], 'A'), [
+            ('host', '', 'A', '10.0.1.1'), ('$generate', 'dyn-$', 'A', '10.0.2.$'),
+            ('last', '', 'A', '10.0.3.1')
+        ])
+        self.assertEqual(new['A'], [
+            ('host.sub.dir.com.', '', 'A', '10.0.1.1'), ('last', '', 'A', '10.0.3.1')
+        ])
+        self.assertEqual([rng.out() for rng in z.generate], ['$GENERATE 1-3 dyn-$ IN A 10.0.2.$'])
+        self.assertEqual(new['NS'], canonical(old['NS'], 'NS'))
+
+
+class ParserTest(TempDirTestCase):
+    
+    def write_zone(self, records):
+        zone_file = self.path('example.com')
+        write_file(zone_file, zone_text('example.com', records))
+        z = zone.Zone('example.com.')
+        z.zone_file = zone_file
+        
+        return z
+    
+    def test_soa(self):
+        z = self.write_zone(['@ IN NS ns1.example.com.'])
+        z.parse_zone_file()
+        self.assertEqual((z.soa['ns'], z.soa['email'], z.soa['serial'], z.soa['refresh'],
+                          z.soa['retry'], z.soa['expiry'], z.soa['minttl']),
+                         ('ns1.example.com.', 'hostmaster.example.com.', '2026101801',
+                          '3h', '1h', '1w', '1h'))
+        self.assertEqual(z.file_serial, '2026101801')
+    
+    def test_no_soa(self):
+        zone_file = self.path('broken')
+        write_file(zone_file, 'www IN A 10.0.0.1\n')
+        z = zone.Zone('broken.')
+        z.zone_file = zone_file
+        self.assertRaises(IndexError, z.parse_zone_file)
+    
+    def test_records_before_soa_skipped(self):
+        zone_file = self.path('example.com')
+        write_file(zone_file, 'early IN A 10.0.0.9\n' + zone_text('example.com', ['www IN A 10.0.0.1']))
+        z = zone.Zone('example.com.')
+        z.zone_file = zone_file
+        z.parse_zone_file()
+        self.assertEqual([rr.src for rr in z.a], ['www'])
+    
+    def test_comment_inside_multi_line_record_kept(self):
+        z = self.write_zone(['srv IN SRV ( 10 5 ; priority, weight', '    5060 sip.example.com. )'])
+        z.parse_zone_file()
+        self.assertEqual(z.srv[0].tgt, 'sip.example.com.')
+        self.assertEqual(z.srv[0].out(), 'srv IN SRV ( 10 5 ; priority, weight\n    5060 sip.example.com. )')
+    
+    def test_fields(self):
+        z = self.write_zone(['@ 600 IN MX 5 mail.example.com. ; main', 'www IN CNAME host'])
+        z.parse_zone_file()
+        self.assertEqual((z.mx[0].src, z.mx[0].ttl, z.mx[0].pref, z.mx[0].tgt, z.mx[0].comment),
+                         ('@', '600', '5', 'mail.example.com.', '; main'))
+        self.assertEqual(z.mx[0].text, None)
+        self.assertEqual((z.cname[0].src, z.cname[0].tgt), ('www', 'host'))
+    
+    def test_iter_records_types(self):
+        z = self.write_zone(['www IN A 10.0.0.1', 'www IN TXT "x"', '$GENERATE 1-2 h$ IN A 10.0.1.$'])
+        records = [(rr.src, rr.tgt) for rr in z.iter_records(types=['A'])]
+        self.assertEqual(records, [('www', '10.0.0.1'), ('h1', '10.0.1.1'), ('h2', '10.0.1.2')])
+        self.assertEqual(z.a, [])
+        self.assertEqual(z.soa['serial'], '2026101801')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# test_record_index.py
+"Tests for the record index behind the find command, and finding zones it is out of date for."
+
+import os
+import time
+import unittest
+
+from support import TempDirTestCase, load_dnsadmin, write_file, zone_text
+import zone
+
+
+class RecordIndexTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.dnsadmin = load_dnsadmin()
+        self.index = zone.RecordIndex(self.path('record_index.db'))
+        self.ip_index = zone.IPIndex(self.path('ip_index.db'))
+        self.zone_files = []
+        for (zone_name, records) in (('a.com', ['@ IN A 10.0.0.1', 'www IN CNAME @', 'Mail IN A 10.0.0.2',
+                                                '@ IN MX 10 mail', '$GENERATE 1-2 h$ IN A 10.0.1.$']),
+                                     ('b.org', ['www IN A 10.0.0.1', 'ext IN CNAME www.a.com.'])):
+            zone_file = self.path('zones', zone_name)
+            write_file(zone_file, zone_text(zone_name, records))
+            self.zone_files.append((zone_name + '.', zone_file))
+            self.reindex(zone_name + '.', zone_file)
+    
+    def tearDown(self):
+        self.index.close()
+        self.ip_index.close()
+        TempDirTestCase.tearDown(self)
+    
+    def reindex(self, zone_name, zone_file):
+        z = zone.Zone(zone_name)
+        z.zone_file = zone_file
+        self.dnsadmin.reindex_zone(z, self.ip_index, self.index)
+    
+    def test_find_name(self):
+        self.assertEqual(self.index.find('name', 'www.a.com.'), [('a.com', 'www.a.com', 'CNAME', 'a.com')])
+        self.assertEqual(self.index.find('name', 'mail.a.com'), [('a.com', 'mail.a.com', 'A', '10.0.0.2')])
+        self.assertEqual([row[1] for row in self.index.find('name', 'h*')], ['h1.a.com', 'h2.a.com'])
+        self.assertEqual([row[0:2] for row in self.index.find('name', '*.com', ['cname'])],
+                         [('a.com', 'www.a.com')])
+        self.assertEqual([row[1] for row in self.index.find('name', 'www*', zone_name='b.org.')], ['www.b.org'])
+    
+    def test_find_target(self):
+        self.assertEqual(sorted([row[0:2] for row in self.index.find('target', '10.0.0.1')]),
+                         [('a.com', 'a.com'), ('b.org', 'www.b.org')])
+        self.assertEqual(self.index.find('target', '*a.com', ['CNAME']),
+                         [('a.com', 'www.a.com', 'CNAME', 'a.com'), ('b.org', 'ext.b.org', 'CNAME', 'www.a.com')])
+        self.assertEqual(self.index.find('target', 'mail.a.com'), [('a.com', 'a.com', 'MX', 'mail.a.com')])
+        self.assertEqual(len(self.index.find('name', '*')), 8)
+        self.assertEqual(self.ip_index.lookup('10.0.1.2'), ['a.com.'])
+    
+    def test_stale_zones(self):
+        self.assertEqual(self.index.stale_zones(self.zone_files), [])
+        # Edited by hand, behind the index's back
+        (zone_name, zone_file) = self.zone_files[1]
+        time.sleep(0.01)
+        write_file(zone_file, zone_text('b.org', ['new IN A 10.0.0.9']))
+        self.assertEqual(self.index.stale_zones(self.zone_files), [self.zone_files[1]])
+        self.reindex(zone_name, zone_file)
+        self.assertEqual(self.index.stale_zones(self.zone_files), [])
+        self.assertEqual(self.index.find('name', 'www.b.org'), [])
+        # Zones never indexed, or whose file has gone, are stale too
+        missing = ('c.net.', self.path('zones', 'c.net'))
+        self.assertEqual(self.index.stale_zones(self.zone_files + [missing]), [missing])
+        os.remove(zone_file)
+        self.assertEqual(self.index.stale_zones(self.zone_files), [self.zone_files[1]])
+    
+    def test_zone_removed(self):
+        self.index.zone_removed('a.com.')
+        self.assertEqual([row[0] for row in self.index.find('name', '*')], ['b.org', 'b.org'])
+        self.assertEqual(self.index.stale_zones(self.zone_files), [self.zone_files[0]])
+
+
+if __name__ == '__main__':
+    unittest.main()
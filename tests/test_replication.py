@@ -0,0 +1,156 @@
+# test_replication.py
+"""Tests for sending changes to the other nameservers, with ssh pointed at a
+stub (stub_ssh.py) that logs what it is asked to do."""
+
+import os
+import StringIO
+import sys
+import tarfile
+import unittest
+from ConfigParser import ConfigParser
+
+from support import TempDirTestCase, load_dnsadmin, read_file, write_file, zone_text
+import zone
+
+stub_ssh = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stub_ssh.py')
+
+
+class Options:
+    dry_run = False
+    restart = True
+    verbose = False
+
+
+class ReplicationTestCase(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.log_dir = self.path('ssh')
+        os.makedirs(self.log_dir)
+        self.environ = os.environ.copy()
+        os.environ['STUB_SSH_LOG'] = self.log_dir
+        self.stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+    
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.environ.clear()
+        os.environ.update(self.environ)
+        TempDirTestCase.tearDown(self)
+    
+    def replicator(self, hosts, parallelism=0):
+        return zone.Replicator(hosts, '%s %s' % (sys.executable, stub_ssh), parallelism)
+    
+    def calls(self):
+        "Return the (host, command) calls ssh got, sorted."
+        
+        lines = read_file(os.path.join(self.log_dir, 'calls')).splitlines()
+        return sorted([tuple(line.split('\t')) for line in lines])
+    
+    def archive_names(self, host, call):
+        "Return the names of the files in the archive a host got on its call'th call."
+        
+        tar = tarfile.open(os.path.join(self.log_dir, '%s.%d.in' % (host, call)))
+        names = sorted(tar.getnames())
+        tar.close()
+        return names
+
+
+class FanOutTest(ReplicationTestCase):
+    
+    def test_run_on_every_peer(self):
+        replicator = self.replicator(['ns1', 'ns2', 'ns3'], parallelism=2)
+        self.assertTrue(replicator.run('rndc reload'))
+        self.assertEqual(self.calls(), [('ns1', 'rndc reload'), ('ns2', 'rndc reload'),
+                                        ('ns3', 'rndc reload')])
+        self.assertEqual(sorted(sys.stdout.getvalue().splitlines()),
+                         ['ns1: ran rndc reload', 'ns2: ran rndc reload', 'ns3: ran rndc reload'])
+        self.assertEqual(replicator.failed_hosts(), [])
+    
+    def test_query(self):
+        replicator = self.replicator(['ns1', 'ns2'])
+        os.environ['STUB_SSH_FAIL'] = 'ns2'
+        # Errors from a query go to our stderr, so keep them out of the way
+        stderr = os.dup(2)
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, 2)
+        try:
+            output = replicator.query('dnsadmin --local-only manifest')
+        finally:
+            os.dup2(stderr, 2)
+            os.close(stderr)
+            os.close(devnull)
+        self.assertEqual(output, {'ns1': 'ns1: ran dnsadmin --local-only manifest\n'})
+        self.assertEqual(replicator.failed_hosts(), ['ns2'])
+    
+    def test_failures_reported(self):
+        replicator = self.replicator(['ns1', 'ns2', 'ns3'])
+        os.environ['STUB_SSH_FAIL'] = 'ns2'
+        host_steps = {}
+        for host in replicator.nameservers:
+            host_steps[host] = [replicator.ssh_step(host, 'first'), replicator.ssh_step(host, 'second')]
+        self.assertFalse(replicator.fan_out(host_steps))
+        # A failed step stops the rest of that peer's steps, but not the others'
+        self.assertEqual(self.calls(), [('ns1', 'first'), ('ns1', 'second'), ('ns2', 'first'),
+                                        ('ns3', 'first'), ('ns3', 'second')])
+        self.assertEqual(replicator.failed_hosts(), ['ns2'])
+        self.assertEqual(replicator.summary(), '\n'.join([
+            "  ns1: OK (2 steps)",
+            "  ns2: FAILED, 'first' exited with status 255",
+            "  ns3: OK (2 steps)"
+        ]))
+        self.assertTrue('Connection refused' in sys.stdout.getvalue())
+
+
+class SyncZonesTest(ReplicationTestCase):
+    
+    def setUp(self):
+        ReplicationTestCase.setUp(self)
+        self.dnsadmin = load_dnsadmin()
+        self.conf = ConfigParser()
+        self.conf.add_section('general')
+        self.conf.set('general', 'data_dir', self.path('data'))
+        os.makedirs(self.path('data'))
+        # A zone changed by one record, with the change in our journal
+        records = ['host%d IN A 10.0.0.%d' % (x, x) for x in range(1, 50)]
+        old = zone_text('a.com', records, '2026101801')
+        records[10] = 'host11 IN A 10.0.1.11'
+        new = zone_text('a.com', records, '2026101802')
+        self.zone_file = self.path('zones', 'a.com')
+        write_file(self.zone_file, new)
+        self.dnsadmin.open_zone_journal(self.conf).record('a.com.', old, new)
+    
+    def test_journal_sent(self):
+        replicator = self.replicator(['ns1', 'ns2'])
+        sent = self.dnsadmin.sync_zones([('a.com.', self.zone_file)], self.conf, Options(), replicator)
+        self.assertEqual(sent, {'ns1': ['a.com.'], 'ns2': ['a.com.']})
+        self.assertEqual(self.calls(), [('ns1', 'dnsadmin --local-only receive'),
+                                        ('ns2', 'dnsadmin --local-only receive')])
+        self.assertEqual(self.archive_names('ns1', 0), ['a.com.jnl'])
+        self.assertEqual(self.archive_names('ns2', 0), ['a.com.jnl'])
+    
+    def test_whole_file_sent_when_journal_rejected(self):
+        replicator = self.replicator(['ns1', 'ns2'])
+        os.environ['STUB_SSH_STALE'] = 'ns2'
+        self.dnsadmin.sync_zones([('a.com.', self.zone_file)], self.conf, Options(), replicator)
+        self.assertEqual(self.calls(), [('ns1', 'dnsadmin --local-only receive'),
+                                        ('ns2', 'dnsadmin --local-only receive'),
+                                        ('ns2', 'dnsadmin --local-only receive')])
+        self.assertEqual(self.archive_names('ns1', 0), ['a.com.jnl'])
+        self.assertEqual(self.archive_names('ns2', 0), ['a.com.jnl'])
+        self.assertEqual(self.archive_names('ns2', 1), ['a.com'])
+        self.assertEqual(replicator.failed_hosts(), [])
+    
+    def test_peer_failure_reported(self):
+        replicator = self.replicator(['ns1', 'ns2'])
+        os.environ['STUB_SSH_FAIL'] = 'ns1'
+        self.dnsadmin.sync_zones([('a.com.', self.zone_file)], self.conf, Options(), replicator)
+        self.assertEqual(replicator.failed_hosts(), ['ns1'])
+        self.assertTrue("ns1: FAILED, 'dnsadmin --local-only receive' exited with status 255"
+                        in replicator.summary())
+        self.assertTrue('ns2: OK (1 steps)' in replicator.summary())
+        self.assertTrue('Connection refused' in sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+# test_write_soa.py
+"Tests for rewriting a zone's SOA in place with Zone.write_soa()."
+
+import hashlib
+import os
+import unittest
+
+from support import TempDirTestCase, read_file, write_file
+import zone
+
+header = '''; hand written, keep this comment
+$TTL   1h   ; default ttl
+example.com.  IN\tSOA ns1.example.com.  hostmaster.example.com. (
+\t2026101801 ; serial
+   3H        ; refresh, in caps
+   1h  1w  ; retry and expiry on one line
+   1h )
+'''
+
+
+class Hook:
+    def __init__(self):
+        self.written = []
+    
+    def soa_written(self, z):
+        self.written.append(z.name)
+
+
+class WriteSoaTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        # Enough records that they are copied across in more than one block
+        records = ['host%d\tIN A 10.%d.%d.%d ; note' % (x, x / 65536, x / 256 % 256, x % 256)
+                   for x in range(60000)]
+        self.contents = header + '\n'.join(records) + '\n'
+        self.zone_file = self.path('example.com')
+        write_file(self.zone_file, self.contents)
+        self.zone = zone.Zone('example.com.')
+        self.zone.zone_file = self.zone_file
+        self.zone.read_soa()
+    
+    def write_soa(self, force=False):
+        return self.zone.write_soa(os.getuid(), os.getgid(), force)
+    
+    def test_read_soa(self):
+        self.assertEqual((self.zone.soa['ttl'], self.zone.soa['serial'], self.zone.soa['refresh'],
+                          self.zone.soa['expiry']), ('1h', '2026101801', '3h', '1w'))
+    
+    def test_bytes_kept(self):
+        self.assertTrue(len(self.contents) > 1048576)
+        self.zone.soa['serial'] = '2026101802'
+        self.zone.soa['retry'] = '2h'
+        self.assertTrue(self.write_soa())
+        expected = self.contents.replace('2026101801', '2026101802', 1).replace(' 1h  1w', ' 2h  1w', 1)
+        self.assertEqual(read_file(self.zone_file), expected)
+        self.assertEqual(self.zone.file_serial, '2026101802')
+    
+    def test_ttl(self):
+        self.zone.soa['ttl'] = '2h'
+        self.assertTrue(self.write_soa(True))
+        self.assertEqual(read_file(self.zone_file), self.contents.replace('$TTL   1h', '$TTL   2h', 1))
+    
+    def test_ttl_added(self):
+        contents = self.contents.replace('$TTL   1h   ; default ttl\n', '')
+        write_file(self.zone_file, contents)
+        self.zone.soa['ttl'] = '2h'
+        self.assertTrue(self.write_soa(True))
+        self.assertEqual(read_file(self.zone_file), '$TTL 2h\n' + contents)
+    
+    def test_serial_only_left_alone(self):
+        self.zone.soa['serial'] = '2026101802'
+        self.assertFalse(self.write_soa())
+        self.assertEqual(self.zone.soa['serial'], '2026101801')
+        self.assertEqual(read_file(self.zone_file), self.contents)
+    
+    def test_journal_and_hooks(self):
+        hook = Hook()
+        self.zone.hooks = [hook]
+        self.zone.journal = zone.ZoneJournal(self.path('journal'))
+        self.zone.soa['serial'] = '2026101802'
+        self.assertTrue(self.write_soa(True))
+        self.assertEqual(hook.written, ['example.com.'])
+        new_contents = read_file(self.zone_file)
+        entry = self.zone.journal.entries('example.com.')[0]
+        self.assertEqual((entry['old_serial'], entry['new_serial']), ('2026101801', '2026101802'))
+        self.assertEqual(entry['old_hash'], hashlib.sha1(self.contents).hexdigest())
+        self.assertEqual(entry['new_hash'], hashlib.sha1(new_contents).hexdigest())
+        self.assertEqual('\n'.join(zone.patch_lines(self.contents.split('\n'), entry['removed'],
+                                                    entry['added'])), new_contents)
+    
+    def test_no_soa(self):
+        write_file(self.zone_file, 'www IN A 10.0.0.1\n')
+        self.zone.soa['serial'] = '2026101802'
+        self.assertRaises(IndexError, self.write_soa, True)
+        self.assertEqual(read_file(self.zone_file), 'www IN A 10.0.0.1\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
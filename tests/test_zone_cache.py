@@ -0,0 +1,123 @@
+# test_zone_cache.py
+"Tests for ZoneCache, and that it is never used for a zone file that has changed."
+
+import os
+import time
+import unittest
+
+from support import TempDirTestCase, write_file, zone_text
+import zone
+
+
+class ZoneCacheTest(TempDirTestCase):
+    
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.zone_file = self.path('zones', 'a.com')
+        self.write_zone('10.0.0.1')
+        self.cache = self.new_cache()
+        zone.Zone.cache = self.cache
+    
+    def tearDown(self):
+        zone.Zone.cache = None
+        TempDirTestCase.tearDown(self)
+    
+    def new_cache(self, max_zones=0):
+        cache = zone.ZoneCache(max_zones, self.path('cache'))
+        cache.settle_time = 0
+        return cache
+    
+    def write_zone(self, ip, zone_file=None):
+        write_file(zone_file or self.zone_file, zone_text('a.com', ['www IN A %s' % ip]))
+    
+    def parse(self, zone_file=None):
+        z = zone.Zone('a.com.')
+        z.zone_file = zone_file or self.zone_file
+        z.parse_zone_file()
+        return [rr.tgt for rr in z.a]
+    
+    def test_hit(self):
+        self.assertEqual(self.parse(), ['10.0.0.1'])
+        self.assertEqual(self.parse(), ['10.0.0.1'])
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+    
+    def test_saved_between_runs(self):
+        self.parse()
+        zone.Zone.cache = cache = self.new_cache(None)
+        self.assertEqual(self.parse(), ['10.0.0.1'])
+        self.assertEqual(cache.hits, 1)
+        # Saved zones from another version of the cache are ignored
+        zone.Zone.cache = cache = self.new_cache(None)
+        cache.version = zone.ZoneCache.version + 1
+        self.parse()
+        self.assertEqual(cache.hits, 0)
+    
+    def test_rewritten_in_place(self):
+        # Same size, same modification time, same inode: only the change time
+        # gives it away
+        self.parse()
+        st = os.stat(self.zone_file)
+        self.write_zone('10.0.0.2')
+        os.utime(self.zone_file, (st.st_atime, st.st_mtime))
+        self.assertEqual(os.stat(self.zone_file).st_ino, st.st_ino)
+        self.assertEqual(self.parse(), ['10.0.0.2'])
+        self.assertEqual(self.cache.hits, 0)
+    
+    def test_renamed_into_place(self):
+        self.parse()
+        st = os.stat(self.zone_file)
+        self.write_zone('10.0.0.3', self.zone_file + '.new')
+        os.utime(self.zone_file + '.new', (st.st_atime, st.st_mtime))
+        os.rename(self.zone_file + '.new', self.zone_file)
+        self.assertEqual(self.parse(), ['10.0.0.3'])
+        self.assertEqual(self.cache.hits, 0)
+    
+    def test_new_files_not_cached(self):
+        self.cache.settle_time = zone.ZoneCache.settle_time
+        self.write_zone('10.0.0.4')
+        self.parse()
+        self.assertEqual(self.cache.zones, {})
+        self.assertFalse(os.path.isfile(self.cache.cache_file(self.zone_file)))
+        # Once it has settled it is
+        then = int(time.time()) - 60
+        self.cache.put(self.zone_file, (then, then, 1, 1), 'state')
+        self.assertEqual(self.cache.zones.keys(), [self.zone_file])
+    
+    def test_forget(self):
+        self.parse()
+        self.cache.forget(self.zone_file)
+        self.assertEqual(self.cache.zones, {})
+        self.assertFalse(os.path.isfile(self.cache.cache_file(self.zone_file)))
+        self.parse()
+        self.assertEqual(self.cache.hits, 0)
+    
+    def test_missing_file(self):
+        self.assertEqual(self.cache.get(self.path('missing'), self.cache.key(self.path('missing'))), None)
+    
+    def test_least_recently_used_dropped(self):
+        cache = zone.ZoneCache(10)
+        key = (0, 0, 1, 1)
+        for x in range(11):
+            cache.put('zone%d' % x, key, x)
+            cache.get('zone0', key)
+        self.assertEqual(len(cache.zones), 10)
+        self.assertFalse('zone1' in cache.zones)
+        self.assertEqual(cache.get('zone0', key), 0)
+    
+    def test_trim(self):
+        cache = zone.ZoneCache(None, self.path('trimmed'), 4000)
+        key = (0, 0, 1, 1)
+        for x in range(20):
+            cache.put('zone%d' % x, key, 'x' * 500)
+            then = time.time() - 100 + x
+            os.utime(cache.cache_file('zone%d' % x), (then, then))
+        cache.close()
+        sizes = [os.path.getsize(os.path.join(self.path('trimmed'), name))
+                 for name in os.listdir(self.path('trimmed'))]
+        self.assertTrue(sum(sizes) <= 4000 * 9 / 10)
+        self.assertTrue(os.path.isfile(cache.cache_file('zone19')))
+        self.assertFalse(os.path.isfile(cache.cache_file('zone0')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,416 @@
 # zone.py
+import errno
+import fcntl
+import hashlib
+import marshal
+import operator
 import os
 import re
+import shlex
 import string
 import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
 from recordtemplates import *
 
+# Matches the start of a resource record line, pulling out the owner name (empty
+# if the line starts with white space), TTL, class and record type. The record
+# data starts where the match ends.
+record_rgxp = re.compile(r'([^\s;]*)\s+(?:([0-9][0-9smhdwSMHDW]*)\s+)?'
+                         r'(?:([Ii][Nn]|[Cc][Hh]|[Hh][Ss]|[Cc][Ss])\s+)?'
+                         r'(?:([0-9][0-9smhdwSMHDW]*)\s+)?([A-Za-z][A-Za-z0-9]*)(?:\s+|$)')
+# Quoted strings in a record
+quoted_rgxp = re.compile(r'"[^"]*"')
+# Parentheses outside of quoted strings
+paren_rgxp = re.compile(r'("[^"]*")|[()]')
+# The serial number in an SOA record, for when we only want that
+soa_serial_rgxp = re.compile(r'\sSOA\s+\S+\s+\S+[\s(]*(?:;[^\n]*\n[\s(]*)*([0-9]+)', re.IGNORECASE)
+# A $TTL line, with the TTL as group 1
+ttl_rgxp = re.compile(r'\$TTL\s+(\S+)', re.IGNORECASE)
+# The fields of an SOA record, between its parentheses (or not)
+soa_token_rgxp = re.compile(r'[^\s()]+')
+# The substitutions in a $GENERATE template: an escaped '$', or '$' with an
+# optional {offset,width,base} modifier
+generate_rgxp = re.compile(r'\\\$|\$\$|\$(?:\{(-?[0-9]+)(?:,([0-9]+)(?:,([doxX]))?)?\})?')
+# The last number in a record's owner, which a $GENERATE counter could stand for
+counter_rgxp = re.compile(r'(0|[1-9][0-9]*)(?=[^0-9]*$)')
+
+def strip_comment(line):
+    "Return line with any ';' comment removed, leaving ';' inside quotes alone."
+    
+    if line.find('"') == -1:
+        return line.split(';', 1)[0]
+    quoted = False
+    for x in range(len(line)):
+        if line[x] == '"':
+            quoted = not quoted
+        elif line[x] == ';' and not quoted:
+            return line[0:x]
+    
+    return line
+
+def paren_depth(line):
+    "Return the number of parentheses opened, less those closed, in line."
+    
+    data = strip_comment(line)
+    if data.find('"') > -1:
+        data = quoted_rgxp.sub('', data)
+    
+    return data.count('(') - data.count(')')
+
+def new_record(rr_type, src, ttl, rrclass, text, rdata_start):
+    """Build a resource record object from a record read from a zone file. text
+is the whole record, which may run over several lines, and its data starts at
+offset rdata_start. The original text is only kept (in the record's 'text'
+attribute) when the record can't be written back out from its fields without
+losing something, e.g. comments inside a multi-line record.
+"""
+    
+    rdata = text[rdata_start:]
+    comment = ''
+    keep_text = False
+    if not (';' in rdata or '"' in rdata or '(' in rdata or '\n' in rdata):
+        rdata = rdata.strip()
+    else:
+        # Separate out the comments, and drop the parentheses
+        lines = rdata.split('\n')
+        data = []
+        for line in lines:
+            line_data = strip_comment(line)
+            if len(line_data) < len(line):
+                if len(lines) == 1:
+                    comment = line[len(line_data):].strip()
+                else:
+                    keep_text = True
+            data.append(line_data.strip())
+        rdata = paren_rgxp.sub(lambda match: match.group(1) or ' ', ' '.join(data))
+        if rdata.find('"') == -1:
+            rdata = ' '.join(rdata.split())
+        else:
+            rdata = rdata.strip()
+    
+    # Records are built without calling __init__, as this is done for every
+    # record in every zone we parse. All the slots are set here instead.
+    rr_class = record_classes[rr_type]
+    rr = rr_class.__new__(rr_class)
+    rr.src = src
+    rr.ttl = ttl
+    if rrclass == None or rrclass == 'IN':
+        rr.rrclass = 'IN'
+    else:
+        rr.rrclass = rrclass.upper()
+    rr.rrtype = rr_type
+    rr.comment = comment
+    rr.tgt = rdata
+    if rr_type == 'MX':
+        fields = rdata.split(None, 1)
+        if len(fields) == 2:
+            (rr.pref, rr.tgt) = fields
+        else:
+            rr.pref = ''
+            keep_text = True
+    elif rr_type == 'SRV':
+        fields = rdata.split(None, 3)
+        if len(fields) == 4:
+            (rr.priority, rr.weight, rr.port, rr.tgt) = fields
+        else:
+            (rr.priority, rr.weight, rr.port) = ('', '', '')
+            keep_text = True
+    elif rr_type == 'TXT':
+        if len(rdata) > 1 and rdata[0] == '"' and rdata[-1] == '"':
+            # TXT.getTgt() puts the outer quotes back
+            rr.tgt = rdata[1:-1]
+        else:
+            keep_text = True
+    elif rr_type == 'HINFO':
+        # HINFO.out() mangles quoted strings, so always keep the text
+        fields = re.findall(r'"[^"]*"|\S+', rdata) + ['', '']
+        (rr.cpu, rr.os) = fields[0:2]
+        keep_text = True
+    if keep_text:
+        rr.text = text
+    else:
+        rr.text = None
+    
+    return rr
+
+def record_slots(rr_type):
+    """Return the names of a record type's attributes, and an operator.attrgetter
+for them, working them out the first time a type is asked for."""
+    
+    slots = record_slot_cache.get(rr_type)
+    if slots == None:
+        names = ResourceRecord.__slots__ + record_classes[rr_type].__slots__
+        slots = (names, operator.attrgetter(*names))
+        record_slot_cache[rr_type] = slots
+    
+    return slots
+
+def record_state(rr):
+    """Return a resource record as plain data (its type and a tuple of its
+attributes, in record_slots() order), for record_from_state() to rebuild."""
+    
+    rr_type = rr.__class__.__name__
+    return (rr_type, record_slots(rr_type)[1](rr))
+
+def record_from_state(state):
+    "Build a resource record from the plain data record_state() returned."
+    
+    (rr_type, values) = state
+    rr_class = record_classes[rr_type]
+    rr = rr_class.__new__(rr_class)
+    # The ResourceRecord attributes come first, then any the type adds
+    if len(values) == 7:
+        (rr.src, rr.ttl, rr.rrclass, rr.rrtype, rr.tgt, rr.comment, rr.text) = values
+    else:
+        (rr.src, rr.ttl, rr.rrclass, rr.rrtype, rr.tgt, rr.comment, rr.text) = values[0:7]
+        for (slot, value) in zip(rr_class.__slots__, values[7:]):
+            setattr(rr, slot, value)
+    
+    return rr
+
+def compile_template(template):
+    """Turn a $GENERATE template into a list of parts for expand_template(): text
+to copy, or (offset, format) tuples for the counter. Returns None if the
+template uses a modifier we don't know (e.g. BIND's nibble mode)."""
+    
+    parts = []
+    pos = 0
+    for match in generate_rgxp.finditer(template):
+        parts.append(template[pos:match.start()])
+        pos = match.end()
+        text = match.group(0)
+        if text in ('\\$', '$$'):
+            parts.append('$')
+        elif text == '$':
+            if template[pos:pos+1] == '{':
+                return None
+            parts.append((0, '%d'))
+        else:
+            (offset, width, base) = match.groups()
+            parts.append((int(offset), '%0' + (width or '0') + (base or 'd')))
+    parts.append(template[pos:])
+    return [part for part in parts if part != '']
+
+def expand_template(parts, value):
+    "Fill in a template compiled by compile_template() for counter value."
+    
+    text = []
+    for part in parts:
+        if part.__class__ is tuple:
+            text.append(part[1] % (value + part[0]))
+        else:
+            text.append(part)
+    return ''.join(text)
+
+def new_generate_range(line):
+    """Build a GenerateRange from a $GENERATE line of a zone file. A line we
+can't make sense of still gives a range, which keeps the line to be written
+back out but stands for no records."""
+    
+    data = strip_comment(line)
+    tokens = data.split()
+    match = None
+    if len(tokens) >= 5:
+        match = re.match(r'^([0-9]+)-([0-9]+)(?:/([0-9]+))?$', tokens[1])
+    if match == None:
+        rng = GenerateRange(0, -1, '', '', '')
+        rng.text = line.rstrip()
+        return rng
+    ttl = ''
+    rrclass = 'IN'
+    fields = tokens[3:]
+    # The TTL and class can come in either order before the type
+    while len(fields) > 2:
+        if fields[0][0].isdigit():
+            ttl = fields.pop(0)
+        elif fields[0].upper() in ('IN', 'CH', 'HS', 'CS'):
+            rrclass = fields.pop(0).upper()
+        else:
+            break
+    rng = GenerateRange(int(match.group(1)), int(match.group(2)), tokens[2],
+                        fields[0].upper(), ' '.join(fields[1:]), ttl, rrclass,
+                        int(match.group(3) or 1))
+    if len(fields) != 2 or len(data.rstrip()) < len(line.rstrip()):
+        # Keep the comment, or whatever else out() would lose
+        rng.text = line.rstrip()
+    return rng
+
+def record_counter(rr):
+    """Work out how a record could be one of a $GENERATE range's: the number at
+the end of its owner is the counter, if the same number is in its target.
+Returns a (value, lhs, rhs) tuple, where lhs and rhs are the owner and target
+with the counter replaced by '$', or None."""
+    
+    if rr.text != None or rr.comment != '' or '$' in rr.src or '$' in rr.tgt:
+        return None
+    match = counter_rgxp.search(rr.src)
+    if match == None:
+        return None
+    number = match.group(1)
+    end = len(rr.tgt)
+    while True:
+        x = rr.tgt.rfind(number, 0, end)
+        if x == -1:
+            return None
+        if (x == 0 or not rr.tgt[x-1].isdigit()) and \
+           (x + len(number) == len(rr.tgt) or not rr.tgt[x+len(number)].isdigit()):
+            break
+        end = x + len(number) - 1
+    return (int(number), rr.src[:match.start()] + '$' + rr.src[match.end():],
+            rr.tgt[:x] + '$' + rr.tgt[x+len(number):])
+
+def file_key(path):
+    """Return a file's (mtime, ctime, size, inode), which change whenever it is
+written, or None if there is no such file. On filesystems that only keep times
+to the second, a write in the same second as the last one that leaves the size
+alone doesn't change the key (see ZoneCache.put())."""
+    
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    
+    return (st.st_mtime, st.st_ctime, st.st_size, st.st_ino)
+
+def parse_cidr(text):
+    """Return an IPv4 address or network (a.b.c.d/n) as an (address as an int,
+prefix length) tuple. Raises ValueError if it isn't one."""
+    
+    if '/' in text:
+        (address, length) = text.split('/', 1)
+        if not length.isdigit() or int(length) > 32:
+            raise ValueError('%s is not a valid network' % text)
+        length = int(length)
+    else:
+        address = text
+        length = 32
+    octets = address.split('.')
+    if len(octets) != 4:
+        raise ValueError('%s is not a valid IP address' % text)
+    value = 0
+    for octet in octets:
+        if not octet.isdigit() or int(octet) > 255:
+            raise ValueError('%s is not a valid IP address' % text)
+        value = (value << 8) | int(octet)
+    if value & ((1 << (32 - length)) - 1):
+        raise ValueError('%s has host bits set' % text)
+    
+    return (value, length)
+
+def int_to_ip(value):
+    "Return an IPv4 address held as an int in dotted form."
+    
+    return '%d.%d.%d.%d' % (value >> 24, (value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+def serial_of(contents):
+    "Pull the SOA serial number out of the contents of a zone file, or '-' if there isn't one."
+    
+    match = soa_serial_rgxp.search(contents)
+    if match:
+        return match.group(1)
+    return '-'
+
+def diff_lines(old_lines, new_lines):
+    """Work out how to turn the list of lines old_lines into new_lines. Returns
+a list of the lines removed from old_lines, and a list of (position, line)
+tuples for the lines added to make new_lines. Lines that are in both keep their
+order in zone files we write, so this can be worked out in one pass of each list
+rather than with a full diff."""
+    
+    counts = {}
+    for line in old_lines:
+        counts[line] = counts.get(line, 0) + 1
+    added = []
+    for x, line in enumerate(new_lines):
+        if counts.get(line, 0) > 0:
+            counts[line] -= 1
+        else:
+            added.append((x, line))
+    removed = []
+    for line in old_lines:
+        if counts.get(line, 0) > 0:
+            counts[line] -= 1
+            removed.append(line)
+    return (removed, added)
+
+def parse_journal(lines):
+    """Read journal entries, in ZoneJournal's format, from lines (a file or list
+of lines). Returns a list of entries, oldest first. Each entry is a dictionary of
+old_serial, new_serial, time, old_hash, new_hash, full (True if the entry has no
+diff), removed and added (as from diff_lines()) and text (the entry as it is in
+the journal)."""
+    
+    entries = []
+    entry = None
+    for line in lines:
+        if line[0] == '@':
+            tokens = line.split()
+            entry = {'old_serial':tokens[1], 'new_serial':tokens[2],
+                     'time':int(tokens[3]), 'old_hash':tokens[4],
+                     'new_hash':tokens[5], 'full':tokens[6] == 'full',
+                     'removed':[], 'added':[], 'text':[line]}
+            entries.append(entry)
+        elif entry != None:
+            entry['text'].append(line)
+            if line[0] == '-':
+                entry['removed'].append(line[1:].rstrip('\n'))
+            elif line[0] == '+':
+                (x, text) = line[1:].rstrip('\n').split(' ', 1)
+                entry['added'].append((int(x), text))
+    for entry in entries:
+        entry['text'] = ''.join(entry['text'])
+    
+    return entries
+
+def patch_lines(old_lines, removed, added):
+    "Apply the changes from diff_lines() to old_lines, returning the new list of lines."
+    
+    counts = {}
+    for line in removed:
+        counts[line] = counts.get(line, 0) + 1
+    kept = []
+    for line in old_lines:
+        if counts.get(line, 0) > 0:
+            counts[line] -= 1
+        else:
+            kept.append(line)
+    # Merge the added lines in at their positions
+    new_lines = []
+    k = 0
+    for (x, line) in added:
+        while len(new_lines) < x and k < len(kept):
+            new_lines.append(kept[k])
+            k += 1
+        new_lines.append(line)
+    new_lines.extend(kept[k:])
+    return new_lines
+
+
 class Zone:
     """BIND DNS Zone class. Holds lists of other objects and can read and write
-records to files.
+records to files. Records are held as ResourceRecord objects, in a list per
+record type (self.a, self.mx, etc.).
 """
     
+    # The record lists, in the order they are written to the zone file
+    rr_list_names = ('ns', 'a', 'aaaa', 'cname', 'mx', 'ptr', 'srv', 'txt', 'hinfo')
+    # A ZoneCache shared by all zones, that parse_zone_file() takes zones from
+    # when their file hasn't changed since it was last read
+    cache = None
+    # The ZoneLocks that write_to_conf() takes the named.conf lock from, if any
+    locks = None
+    # The SOA fields, in the order they come in the record
+    soa_fields = ('ns', 'email', 'serial', 'refresh', 'retry', 'expiry', 'minttl')
+    # How far into a zone file read_soa() looks for the SOA
+    soa_search_size = 1048576
+    # The shortest run of A or PTR records following a pattern that
+    # write_zone_file() replaces with a $GENERATE range (0 to never do so)
+    generate_min_run = 0
+    
     def __init__(self, zone, debug=False):
         self.name = zone
         # Create empty lists for A, CNAME, PTR & MX records
@@ -22,6 +423,9 @@ records to files.
         self.ptr   = []
         self.srv   = []
         self.txt   = []
+        # $GENERATE ranges, kept as GenerateRange objects rather than the
+        # records they stand for
+        self.generate = []
         # Create empty dictionary for SOA.
         self.soa = {
             'ttl':None, 'ns':None, 'email':None, 'serial':None,
@@ -29,6 +433,16 @@ records to files.
         }
         self.conf_entry = ''
         self.zone_file = '' # full path to zone file
+        # Serial number found in the zone file when it was parsed, and the
+        # file's file_key() at the time
+        self.file_serial = None
+        self.file_key = None
+        # Objects told about every write of this zone (e.g. an IPIndex). Each
+        # must provide zone_written(zone), soa_written(zone) (for writes that
+        # only changed the SOA) and zone_removed(zone_name).
+        self.hooks = []
+        # A ZoneJournal to record each change to the zone file in, if any
+        self.journal = None
         self.debug = debug
 
     def __cmp__(self, other):
@@ -62,101 +476,215 @@ records to files.
         return soaStr
     
     def parse_zone_file(self, zoneFile=None):
-        "Read a zone file and fill zone attributes with the contents"
+        """Read a zone file and fill zone attributes with the contents. The
+records come from read_records(), so the file is read once, a line at a time.
+Raises IndexError if the file has no usable SOA.
+
+The record lists hold record objects, so records come back out (by out()) in
+dnsadmin's own layout rather than as the lines in the file. On purpose, owners
+and the data of records other than TXT and HINFO are lower cased (as the record
+classes have always done), left out owners are filled in, owners below an
+$ORIGIN are qualified with it, $GENERATE ranges are kept in self.generate rather
+than among the records of their type, and a record running over several lines
+is joined onto one line with all its data kept (e.g. every string of a
+multi-line TXT record).
+"""
         
         if zoneFile == None:
             zoneFile = self.zone_file
         
+        started = time.time()
+        self.file_key = file_key(zoneFile)
+        if self.cache != None:
+            cache_key = self.file_key
+            state = self.cache.get(zoneFile, cache_key)
+            if state != None:
+                self.set_state(state)
+                timings.add('cache', time.time() - started)
+                return
+        
         try:
             zf = open(zoneFile, 'r')
-            # Iterate through lines of zonefile.
-            for line in zf:
-                # pull out the $TTL line
-                if line.startswith('$TTL'):
-                    tokens = line.split()
-                    self.soa['ttl'] = tokens[1].strip(string.whitespace)
-                    break
-            # Find the start and end positions of the SOA.
-            zf.seek(0,2)
-            endPos = zf.tell()
-            zf.seek(0)
-            while zf.tell() < endPos:
-                lineStart = zf.tell()
-                line = zf.readline()
-                lineEnd = zf.tell()
-                if line.find('(') > -1:
-                    soaStart = lineStart
-                if line.find(')') > -1:
-                    soaEnd = lineEnd
-                    break
-                zf.seek(zf.tell())
-            zf.seek(soaStart)
-            # Read the SOA section
-            soaTmp = zf.read(soaEnd - soaStart)
-            # We need to reduce soaTmp to one line (soaStr).
-            soaLines = soaTmp.split('\n');
-            soaStr = ''
-            # Remove all comments from soaLines.
-            for line in soaLines:
-                if line.find(';') > 0:
-                    soaStr = soaStr + line[0:line.find(';')]
-                else:
-                    soaStr = soaStr + line
-            soaStr = soaStr.lower()
-            # Tokenize on whitespace
-            soaTokensTmp = soaStr.split()
-            # Remove list items that are just spaces from soaTokens
-            soaTokens = []
-            for token in soaTokensTmp:
-                # Don't add any of the junk that isn't actual data
-                if token != '' and token != 'in' and token != 'soa' \
-                and token != '(' and token != ')':
-                    soaTokens.append(token)
-
-            # Assign our soa values
-            self.soa['ns'] = soaTokens[1]
-            self.soa['email'] = soaTokens[2]
-            self.soa['serial'] = soaTokens[3]
-            self.soa['refresh'] = soaTokens[4]
-            self.soa['retry'] = soaTokens[5]
-            self.soa['expiry'] = soaTokens[6]
-            self.soa['minttl'] = soaTokens[7]
-            # Now read in all the Resource Records
-            zf.seek(soaEnd)
-            rrTmp = zf.read()
-            zf.close() # Finished with the zone file now
-            # Read Resource Records into the relevant lists
-            rrLines = rrTmp.split('\n')
-            for rr in rrLines:
-                # Search for A record
-                if re.search(r"\s+in\s+a\s+", rr, re.IGNORECASE):
-                    self.a.append(rr)
-                # Search for AAAA record
-                elif re.search(r"\s+in\s+aaaa\s+", rr, re.IGNORECASE):
-                    self.aaaa.append(rr)
-                # Search for CNAME record    
-                elif re.search(r"\s+in\s+cname\s+", rr, re.IGNORECASE):
-                    self.cname.append(rr)
-                # Search for HINFO record
-                elif re.search(r"\s+in\s+hinfo\s+", rr, re.IGNORECASE):
-                    self.hinfo.append(rr)
-                # Search for MX record
-                elif re.search(r"\s+in\s+mx\s+", rr, re.IGNORECASE):
-                    self.mx.append(rr)
-                # Search for NS record
-                elif re.search(r"\s+in\s+ns\s+", rr, re.IGNORECASE):
-                    self.ns.append(rr)
-                # Search for PTR record
-                elif re.search(r"\s+in\s+ptr\s+", rr, re.IGNORECASE):
-                    self.ptr.append(rr)
-                # Search for SRV record
-                elif re.search(r"\s+in\s+srv\s+", rr, re.IGNORECASE):
-                    self.srv.append(rr)
-                # Search for TXT record
-                elif re.search(r"\s+in\s+txt\s+", rr, re.IGNORECASE):
-                    self.txt.append(rr)
         except IOError:
             return False
+        
+        # The list each record type we keep should be added to
+        rr_lists = {
+            'A':self.a, 'AAAA':self.aaaa, 'CNAME':self.cname, 'HINFO':self.hinfo,
+            'MX':self.mx, 'NS':self.ns, 'PTR':self.ptr, 'SRV':self.srv,
+            'TXT':self.txt, '$GENERATE':self.generate
+        }
+        try:
+            for rr in self.read_records(zf, expand=False):
+                rr_lists[rr.rrtype].append(rr)
+        finally:
+            nbytes = zf.tell()
+            zf.close() # Finished with the zone file now
+            timings.add('parse', time.time() - started, nbytes)
+        
+        if self.cache != None:
+            started = time.time()
+            self.cache.put(zoneFile, cache_key, self.get_state())
+            timings.add('cache', time.time() - started)
+    
+    def file_changed(self):
+        "Check whether the zone file has changed since we parsed it."
+        
+        return file_key(self.zone_file) != self.file_key
+    
+    def iter_records(self, zoneFile=None, types=None):
+        """Yield the records in a zone file one at a time, without keeping them,
+so even the largest zones can be searched in constant memory. The records that
+$GENERATE ranges stand for are included. If types (a list of record types, e.g.
+['A', 'CNAME']) is given, only records of those types are built. The zone's SOA
+is filled in once it has been read, but its record lists are left alone. Raises
+IOError if the file can't be opened and IndexError if it has no usable SOA.
+"""
+        
+        if zoneFile == None:
+            zoneFile = self.zone_file
+        
+        zf = open(zoneFile, 'r')
+        try:
+            for rr in self.read_records(zf, types):
+                yield rr
+        finally:
+            zf.close()
+    
+    def read_records(self, zf, types=None, expand=True):
+        """Generator behind parse_zone_file() and iter_records(), reading the
+records from the open zone file zf (only those of the given types, if types is
+given). A single compiled regexp picks out the owner and type of each record,
+and lines are joined into one record while inside parentheses. Records before
+the SOA are skipped. $GENERATE ranges are expanded into their records, or with
+expand False yielded as GenerateRange objects. Raises IndexError, once the file
+has been read, if there was no usable SOA.
+"""
+        
+        # The proper name of each record type we build. Upper and lower case
+        # keys save an upper() call for most records.
+        rr_types = {}
+        for rr_type in record_classes.keys():
+            if types == None or rr_type in types:
+                rr_types[rr_type] = rr_type
+                rr_types[rr_type.lower()] = rr_type
+        record_match = record_rgxp.match
+        origin = self.name
+        last_owner = '@'
+        found_soa = False
+        found_ttl = False
+        depth = 0      # how many parentheses we are inside
+        rr_lines = []  # lines of a record that spans several lines
+        for line in zf:
+            if depth > 0:
+                # This line carries on the record we are reading
+                rr_lines.append(line.rstrip('\n'))
+                depth = depth + paren_depth(line)
+                if depth > 0:
+                    continue
+                rr = '\n'.join(rr_lines)
+                rr_lines = []
+            else:
+                match = record_match(line)
+                if match == None:
+                    if line[0] == '$':
+                        tokens = strip_comment(line).split()
+                        directive = tokens[0].upper()
+                        if directive == '$TTL' and not found_ttl:
+                            self.soa['ttl'] = tokens[1]
+                            found_ttl = True
+                        elif directive == '$ORIGIN':
+                            origin = tokens[1].lower()
+                        elif directive == '$GENERATE' and found_soa:
+                            rng = new_generate_range(line)
+                            if origin != self.name and rng.text == None and rng.lhs[-1] != '.':
+                                # Owners don't keep their place in the file
+                                if rng.lhs == '@':
+                                    rng.lhs = origin
+                                else:
+                                    rng.lhs = rng.lhs + '.' + origin
+                            if not expand:
+                                yield rng
+                            elif types == None or rng.rr_type in types:
+                                for rr in rng.records():
+                                    yield rr
+                    # Otherwise it is a blank line or a comment
+                    continue
+                (owner, ttl, rrclass, ttl2, rr_type) = match.groups()
+                rdata_start = match.end()
+                if '(' in line:
+                    depth = paren_depth(line)
+                    if depth > 0:
+                        rr_lines.append(line.rstrip('\n'))
+                        continue
+                rr = line.rstrip('\n')
+            
+            # We have a whole record. Fill in the owner if it was left out, and
+            # qualify owners relative to an $ORIGIN that isn't this zone, as
+            # records don't keep their place in the file.
+            if owner == '':
+                rr = last_owner + rr
+                rdata_start = rdata_start + len(last_owner)
+                owner = last_owner
+            elif origin != self.name and owner[-1] != '.':
+                if owner == '@':
+                    qualified = origin
+                else:
+                    qualified = owner + '.' + origin
+                rr = qualified + rr[len(owner):]
+                rdata_start = rdata_start + len(qualified) - len(owner)
+                owner = qualified
+            last_owner = owner
+            
+            name = rr_types.get(rr_type)
+            if name == None:
+                name = rr_types.get(rr_type.upper())
+            if name != None:
+                if found_soa:
+                    yield new_record(name, owner, ttl or ttl2 or '', rrclass, rr, rdata_start)
+            elif not found_soa and rr_type.upper() == 'SOA':
+                tokens = []
+                for soa_line in rr.split('\n'):
+                    tokens.extend(strip_comment(soa_line).replace('(', ' ').replace(')', ' ').lower().split())
+                # The SOA data follows the 'soa' token
+                soa_tokens = tokens[tokens.index('soa')+1:]
+                self.soa['ns'] = soa_tokens[0]
+                self.soa['email'] = soa_tokens[1]
+                self.soa['serial'] = soa_tokens[2]
+                self.soa['refresh'] = soa_tokens[3]
+                self.soa['retry'] = soa_tokens[4]
+                self.soa['expiry'] = soa_tokens[5]
+                self.soa['minttl'] = soa_tokens[6]
+                self.file_serial = soa_tokens[2]
+                found_soa = True
+        
+        if not found_soa:
+            raise IndexError('No SOA found in %s' % zf.name)
+    
+    def get_state(self):
+        """Return the zone's SOA and records as plain data (tuples, strings and
+a dict), which set_state() can fill a zone from."""
+        
+        rr_lists = []
+        for name in self.rr_list_names:
+            rr_lists.append(tuple([record_state(rr) for rr in getattr(self, name)]))
+        ranges = tuple([(rng.start, rng.stop, rng.step, rng.lhs, rng.ttl, rng.rrclass,
+                         rng.rr_type, rng.rhs, rng.text) for rng in self.generate])
+        
+        return (self.soa.copy(), self.file_serial, tuple(rr_lists), ranges)
+    
+    def set_state(self, state):
+        "Replace the zone's SOA and records with those from get_state()."
+        
+        (soa, self.file_serial, rr_lists, ranges) = state
+        self.soa = soa.copy()
+        for x in range(len(self.rr_list_names)):
+            setattr(self, self.rr_list_names[x], [record_from_state(rr) for rr in rr_lists[x]])
+        self.generate = []
+        for (start, stop, step, lhs, ttl, rrclass, rr_type, rhs, text) in ranges:
+            rng = GenerateRange(start, stop, lhs, rr_type, rhs, ttl, rrclass, step)
+            rng.text = text
+            self.generate.append(rng)
     
     def zone_exists(self, zoneFile=None):
         "Check to see if our zone file exists."
@@ -171,8 +699,30 @@ records to files.
         
         return result
         
-    def write_to_conf(self, conf_path):
-        "Write entry to BIND config file for this zone."
+    def write_to_conf(self, conf_path, managed_conf=None):
+        """Write entry to BIND config file for this zone. If managed_conf (a
+ManagedConf) is given, the entry goes in its shard files instead of conf_path.
+Returns False if the zone already had an entry."""
+        
+        if self.locks != None:
+            self.locks.lock_conf()
+        try:
+            return self.add_conf_entry(conf_path, managed_conf)
+        finally:
+            if self.locks != None:
+                self.locks.unlock_conf()
+    
+    def add_conf_entry(self, conf_path, managed_conf=None):
+        "Add our entry to the BIND config, for write_to_conf(), with named.conf locked."
+        
+        started = time.time()
+        if managed_conf != None:
+            try:
+                written = managed_conf.add_zone(self.name, self.conf_entry)
+            except (OSError, sqlite3.Error):
+                raise IOError
+            timings.add('conf', time.time() - started)
+            return written
         
         rgxp_str = '"' + self.name[0:-1] + '"'
         zone_rgxp = re.compile(rgxp_str)
@@ -197,59 +747,404 @@ records to files.
             f.close
         except IOError:
             raise IOError
+        timings.add('conf', time.time() - started)
         
         return written
     
-    def write_zone_file(self, uid, gid):
-      	"Write current zone contents to zone file."
-      	
-      	file_contents = self.getSoa()
-        # output the NS records to file_contents
-        if len(self.ns) > 0:
-            for ns in self.ns:
-                file_contents = file_contents + '\n' + ns
-        # output the A records to file_contents
-        if len(self.a) > 0:
-            for a in self.a:
-                file_contents = file_contents + '\n' + a
-        # output the AAAA records to file_contents
-        if len(self.aaaa) > 0:
-            for aaaa in self.aaaa:
-                file_contents = file_contents + '\n' + aaaa
-        # output the CNAME records to file_contents
-        if len(self.cname) > 0:
-            for cname in self.cname:
-                file_contents = file_contents + '\n' + cname
-        # output the MX records to file_contents
-        if len(self.mx) > 0:
-            for mx in self.mx:
-                file_contents = file_contents + "\n" + mx
-        # output the PTR records to file_contents
-        if len(self.ptr) > 0:
-            for ptr in self.ptr:
-                file_contents = file_contents + "\n" + ptr
-        # output the SRV records to file_contents
-        if len(self.srv) > 0:
-            for srv in self.srv:
-                file_contents = file_contents + "\n" + srv
-        # output the TXT records to file_contents        
-        if len(self.txt) > 0:
-            for txt in self.txt:
-                file_contents = file_contents + "\n" + txt
-                
-      	try:
-            f = open(self.zone_file, 'w+t')
-            f.write(file_contents)
-            f.write('\n')
-            f.close
-        except IOError:
-            raise IOError
+    def write_zone_file(self, uid, gid, force=False):
+        """Write current zone contents to zone file. The zone is written to a
+temporary file in the same directory which is then renamed over the zone file,
+so named never reads a half written zone. Unless force is True, a zone file
+that already holds these records (with the serial it was parsed with) is left
+alone and the serial is put back. If the zone has a journal, the change is
+recorded in it. Returns True if the file was written.
+"""
+        
+        started = time.time()
+        if self.generate_min_run > 0 or len(self.generate) > 0:
+            self.compact_ranges(self.generate_min_run)
+        records = []
+        for name in self.rr_list_names:
+            for rr in getattr(self, name):
+                records.append(rr.out())
+        for rng in self.generate:
+            records.append(rng.out())
+        records.append('')
+        body = '\n'.join(records)
+        file_contents = self.getSoa() + '\n' + body
+        
+        # Nothing to do if the file already has these records. Compare against
+        # the contents rendered with the serial that is in the file, so a bumped
+        # serial alone doesn't count as a change.
+        check_unchanged = not force and self.file_serial != None
+        on_disk = None
+        if check_unchanged and os.path.isfile(self.zone_file):
+            new_serial = self.soa['serial']
+            self.soa['serial'] = self.file_serial
+            old_contents = self.getSoa() + '\n' + body
+            self.soa['serial'] = new_serial
+            if os.path.getsize(self.zone_file) == len(old_contents):
+                on_disk = self.read_zone_file()
+                if on_disk == old_contents:
+                    self.soa['serial'] = self.file_serial
+                    return False
+        # The journal needs the old contents
+        if self.journal != None and on_disk == None and os.path.isfile(self.zone_file):
+            on_disk = self.read_zone_file()
+
+        chown_time = self.replace_zone_file(lambda f: f.write(file_contents), uid, gid)
+        self.file_serial = self.soa['serial']
+        self.file_key = file_key(self.zone_file)
+        timings.add('chown', chown_time)
+        timings.add('write', time.time() - started - chown_time, len(file_contents))
+        
+        if self.journal != None and on_disk != None:
+            started = time.time()
+            try:
+                self.journal.record(self.name, on_disk, file_contents)
+            except (IOError, OSError):
+                # Without the entry, other nameservers will just be sent the
+                # whole zone file.
+                pass
+            timings.add('journal', time.time() - started)
         
-        # chown the zone file
+        # Let our hooks (indexes, etc.) know about the new zone contents
+        started = time.time()
+        for hook in self.hooks:
+            hook.zone_written(self)
+        timings.add('hooks', time.time() - started)
+        return True
+
+    def replace_zone_file(self, write_contents, uid, gid):
+        """Replace the zone file with one written by write_contents(f), where f
+is a temporary file in the same directory that is then renamed over the zone
+file, so named never reads a half written zone. The new file keeps the mode of
+the old one (or is made world readable) and is owned by uid and gid. Returns the
+time spent on chmod and chown. The zone file's directory is made if it isn't
+there. Raises IOError if the file can't be written.
+"""
+
+        # Keep the mode of an existing zone file, otherwise make it world readable
+        try:
+            mode = os.stat(self.zone_file).st_mode & 07777
+        except OSError:
+            mode = 0644
+        zone_dir = os.path.dirname(self.zone_file) or '.'
+        try:
+            try:
+                (fd, tmp_file) = tempfile.mkstemp(dir=zone_dir,
+                    prefix='.' + os.path.basename(self.zone_file) + '.')
+            except OSError, e:
+                # The first zone hashed into a directory has to make it
+                if e.errno != errno.ENOENT:
+                    raise
+                try:
+                    os.makedirs(zone_dir)
+                except OSError, e:
+                    if e.errno != errno.EEXIST:
+                        raise
+                (fd, tmp_file) = tempfile.mkstemp(dir=zone_dir,
+                    prefix='.' + os.path.basename(self.zone_file) + '.')
+        except OSError, e:
+            raise IOError(e)
+        try:
+            f = os.fdopen(fd, 'w')
+            write_contents(f)
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+            chown_started = time.time()
+            os.chmod(tmp_file, mode)
+            os.chown(tmp_file, uid, gid)
+            chown_time = time.time() - chown_started
+            os.rename(tmp_file, self.zone_file)
+        except (IOError, OSError), e:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+            raise IOError(e)
+        # Make sure the rename itself survives a crash
+        try:
+            dir_fd = os.open(zone_dir, os.O_RDONLY)
+            os.fsync(dir_fd)
+            os.close(dir_fd)
+        except OSError:
+            pass
+
+        return chown_time
+
+    def read_soa_header(self, zf):
+        """Read the open zone file zf up to the end of its SOA record, without
+going any further into the records. Returns a (header, values, spans) tuple:
+header is the text read, values maps each SOA field (and 'ttl', if there is a
+$TTL line before the SOA) to its value in the file, and spans maps them to the
+(start, end) offsets of those values in header. Raises IndexError if there is
+no SOA within soa_search_size bytes of the start of the file.
+"""
+
+        header = []
+        size = 0
+        values = {}
+        spans = {}
+        tokens = None  # (value, start, end) for each SOA field, once it is found
+        depth = 0      # how many parentheses we are inside
+        while size < self.soa_search_size:
+            line = zf.readline()
+            if line == '':
+                break
+            start = size
+            header.append(line)
+            size = size + len(line)
+            if tokens == None:
+                if depth > 0:
+                    # This line carries on a record before the SOA
+                    depth = depth + paren_depth(line)
+                    continue
+                match = record_rgxp.match(line)
+                if match == None:
+                    if line[0] == '$' and not 'ttl' in values:
+                        ttl_match = ttl_rgxp.match(strip_comment(line))
+                        if ttl_match != None:
+                            values['ttl'] = ttl_match.group(1)
+                            spans['ttl'] = (start + ttl_match.start(1), start + ttl_match.end(1))
+                    continue
+                if match.group(5).upper() != 'SOA':
+                    depth = paren_depth(line)
+                    continue
+                tokens = []
+                offset = match.end()
+            else:
+                offset = 0
+            data = strip_comment(line)
+            for token in soa_token_rgxp.finditer(data, min(offset, len(data))):
+                tokens.append((token.group(0), start + token.start(), start + token.end()))
+            depth = depth + paren_depth(line)
+            if depth <= 0:
+                break
+
+        if tokens == None or depth > 0 or len(tokens) < len(self.soa_fields):
+            raise IndexError('No SOA found at the start of %s' % zf.name)
+        for x, field in enumerate(self.soa_fields):
+            (value, start, end) = tokens[x]
+            values[field] = value.lower()
+            spans[field] = (start, end)
+
+        return (''.join(header), values, spans)
+
+    def read_soa(self, zoneFile=None):
+        """Fill in the zone's SOA (and file_serial) from the top of its zone file,
+without reading the records, which is all that is needed to change the serial or
+TTL with write_soa(). Raises IOError if the file can't be read and IndexError if
+there is no SOA near the start of it.
+"""
+
+        if zoneFile == None:
+            zoneFile = self.zone_file
+
+        started = time.time()
+        zf = open(zoneFile, 'r')
         try:
-            os.chown(self.zone_file, uid, gid)
+            (header, values, spans) = self.read_soa_header(zf)
+        finally:
+            zf.close()
+        for field in self.soa_fields:
+            self.soa[field] = values[field]
+        if 'ttl' in values:
+            self.soa['ttl'] = values['ttl']
+        self.file_serial = values['serial']
+        timings.add('parse', time.time() - started, len(header))
+
+    def write_soa(self, uid, gid, force=False):
+        """Write the zone's SOA (and $TTL) into its zone file, leaving everything
+else in the file as it is. Only the lines up to the end of the SOA record are
+rewritten; the records after them are copied across a block at a time without
+being parsed, so this takes no longer for a huge zone than it takes to copy it.
+A $TTL line is added at the top if the TTL is set and the file has none. As in
+write_zone_file(), the new file is renamed into place, the change is journalled
+and our hooks are told (through soa_written()). Unless force is True, a file
+whose SOA only differs in its serial is left alone and the serial is put back.
+Returns True if the file was written. Raises IOError if it can't be, and
+IndexError if there is no SOA near the start of it.
+"""
+
+        started = time.time()
+        zf = open(self.zone_file, 'r')
+        try:
+            (header, values, spans) = self.read_soa_header(zf)
+            changes = []
+            changed_fields = []
+            for field in ('ttl',) + self.soa_fields:
+                new_value = self.soa[field]
+                if new_value == None or str(new_value) == values.get(field):
+                    continue
+                changed_fields.append(field)
+                if field in spans:
+                    changes.append(spans[field] + (str(new_value),))
+                else:
+                    changes.append((0, 0, '$TTL %s\n' % new_value))
+            if not force and changed_fields in ([], ['serial']):
+                self.soa['serial'] = values['serial']
+                return False
+
+            # Patch the new values in from the end, so the earlier spans still
+            # point at the right text
+            new_header = header
+            for (start, end, text) in sorted(changes, reverse=True):
+                new_header = new_header[:start] + text + new_header[end:]
+
+            old_hash = hashlib.sha1(header)
+            new_hash = hashlib.sha1(new_header)
+            copied = [len(new_header)]
+            def copy_zone_file(f):
+                f.write(new_header)
+                while True:
+                    block = zf.read(1048576)
+                    if block == '':
+                        break
+                    f.write(block)
+                    copied[0] += len(block)
+                    if self.journal != None:
+                        old_hash.update(block)
+                        new_hash.update(block)
+            chown_time = self.replace_zone_file(copy_zone_file, uid, gid)
+        finally:
+            zf.close()
+        self.file_serial = self.soa['serial']
+        self.file_key = file_key(self.zone_file)
+        timings.add('chown', chown_time)
+        timings.add('write', time.time() - started - chown_time, copied[0])
+
+        if self.journal != None:
+            started = time.time()
+            # Only the header changed, and it is at the top of both files, so
+            # its diff is the diff of the whole file.
+            old_lines = header.split('\n')
+            new_lines = new_header.split('\n')
+            (removed, added) = diff_lines(old_lines, new_lines)
+            if patch_lines(old_lines, removed, added) != new_lines:
+                removed = added = None
+            try:
+                self.journal.record_diff(self.name, values['serial'], self.soa['serial'],
+                                         old_hash.hexdigest(), new_hash.hexdigest(),
+                                         removed, added)
+            except (IOError, OSError):
+                pass
+            timings.add('journal', time.time() - started)
+
+        started = time.time()
+        for hook in self.hooks:
+            hook.soa_written(self)
+        timings.add('hooks', time.time() - started)
+        return True
+
+    def read_zone_file(self):
+        "Return the contents of the zone file, or None if it can't be read."
+        
+        try:
+            f = open(self.zone_file, 'r')
+            contents = f.read()
+            f.close()
         except IOError:
-            raise IOError
+            return None
+        
+        return contents
+    
+    def a_record_ips(self):
+        "Return a list of the IP addresses used by this zone's A records."
+        
+        ips = []
+        seen = {}
+        for rr in self.all_records('a'):
+            if not rr.tgt in seen:
+                seen[rr.tgt] = True
+                ips.append(rr.tgt)
+        
+        return ips
+    
+    def all_records(self, list_name):
+        """Yield the records in one of the zone's record lists (e.g. 'a'), then
+those its $GENERATE ranges of that type stand for."""
+        
+        for rr in getattr(self, list_name):
+            yield rr
+        rr_type = list_name.upper()
+        for rng in self.generate:
+            if rng.rr_type == rr_type:
+                for rr in rng.records():
+                    yield rr
+
+    def split_ranges(self, list_name, match):
+        """Take the records for which match(rr) is true out of the zone's
+$GENERATE ranges of one type (e.g. 'a'), and add them to the record list, so
+they can be changed. What is left of each range stays a range."""
+        
+        rr_type = list_name.upper()
+        ranges = []
+        for rng in self.generate:
+            taken = {}
+            if rng.rr_type == rr_type:
+                for (value, rr) in zip(rng.values(), rng.records()):
+                    if match(rr):
+                        taken[value] = True
+                        getattr(self, list_name).append(rr)
+            if len(taken) > 0:
+                ranges.extend(rng.without(taken))
+            else:
+                ranges.append(rng)
+        self.generate = ranges
+
+    def compact_ranges(self, min_run=0):
+        """Fold A and PTR records into $GENERATE ranges. Records whose owner and
+target follow the pattern of a range (see record_counter()), and whose counter
+is next to or inside it, are merged into it; ranges that meet are merged too.
+If min_run is over 0, runs of at least min_run records following a pattern
+become new ranges. The ranges are never expanded to do this."""
+        
+        for list_name in ('a', 'ptr'):
+            rr_type = list_name.upper()
+            # key -> list of (start, stop, range or record)
+            groups = {}
+            for rng in self.generate:
+                key = rng.key()
+                if key != None and key[0] == rr_type:
+                    groups.setdefault(key, []).append((rng.start, rng.stop, rng))
+            if len(groups) == 0 and min_run <= 0:
+                continue
+            for rr in getattr(self, list_name):
+                counter = record_counter(rr)
+                if counter == None:
+                    continue
+                (value, lhs, rhs) = counter
+                key = (rr_type, lhs, rhs, rr.ttl, rr.rrclass)
+                if key in groups or min_run > 0:
+                    groups.setdefault(key, []).append((value, value, rr))
+            
+            dropped = {} # id() of the ranges and records folded into new ranges
+            added = []
+            for (key, members) in groups.items():
+                members.sort(key=operator.itemgetter(0, 1))
+                run = [members[0]]
+                stop = members[0][1]
+                for member in members[1:] + [None]:
+                    if member != None and member[0] <= stop + 1:
+                        run.append(member)
+                        stop = max(stop, member[1])
+                        continue
+                    ranges = [m for m in run if m[2].__class__ is GenerateRange]
+                    if (len(ranges) > 0 and len(run) > 1) or \
+                       (len(ranges) == 0 and min_run > 0 and stop - run[0][0] + 1 >= min_run):
+                        for m in run:
+                            dropped[id(m[2])] = True
+                        (rr_type, lhs, rhs, ttl, rrclass) = key
+                        added.append(GenerateRange(run[0][0], stop, lhs, rr_type, rhs, ttl, rrclass))
+                    if member != None:
+                        run = [member]
+                        stop = member[1]
+            if len(dropped) > 0:
+                setattr(self, list_name, [rr for rr in getattr(self, list_name) if not id(rr) in dropped])
+                self.generate = [rng for rng in self.generate if not id(rng) in dropped] + added
+                self.generate.sort(key=lambda rng: (rng.rr_type, rng.start))
     
     def add_default_records(self, record_type, ip=None):
         # Look for Default.* lists to see what defaults should be set up.
@@ -264,7 +1159,7 @@ records to files.
                 else:
                   a_record.tgt = ip
                 # add this A record to our zone's list
-                self.a.append(a_record.out())
+                self.a.append(a_record)
         
         if record_type.upper() == 'AAAA' and len(Defaults.AAAA) > 0:
             # create an AAAA record object for each default
@@ -276,7 +1171,7 @@ records to files.
                 else:
                   aaaa_record.tgt = ip
                 # add this A record to our zone's list
-                self.aaaa.append(aaaa_record.out())
+                self.aaaa.append(aaaa_record)
 
         if record_type.upper() == 'CNAME' and len(Defaults.CNAME) > 0:
             # create a CNAME record object for each default
@@ -287,7 +1182,7 @@ records to files.
                 cname_record.src = cname[0]
                 cname_record.tgt = cname[1]
                 # add this CNAME record to our zone's list
-                self.cname.append(cname_record.out())
+                self.cname.append(cname_record)
         
         if record_type.upper() == 'MX' and len(Defaults.MX) > 0:
             # create an MX record for each default
@@ -299,7 +1194,7 @@ records to files.
                 mx_record.pref = mx[1]
                 mx_record.tgt = mx[2]
                 # add this MX record to our zone's list
-                self.mx.append(mx_record.out())
+                self.mx.append(mx_record)
         
         if record_type.upper() == 'NS' and len(Defaults.NS) > 0:
             # create an NS record for each default
@@ -310,7 +1205,7 @@ records to files.
                 ns_record.src = ns[0]
                 ns_record.tgt = ns[1]
                 # add this NS record to our zone's list
-                self.ns.append(ns_record.out())
+                self.ns.append(ns_record)
                 
         if record_type.upper() == 'TXT' and len(Defaults.TXT) > 0:
             # create an TXT record for each default
@@ -321,16 +1216,1325 @@ records to files.
                 txt_record.src = txt[0]
                 txt_record.tgt = txt[1]
                 # add this NS record to our zone's list
-                self.txt.append(txt_record.out())
+                self.txt.append(txt_record)
+        
+
+class GenerateRange:
+    """A BIND $GENERATE directive, standing for a run of records whose owner and
+target only differ by a counter, e.g. '$GENERATE 1-254 $ PTR host-10-1-2-$.net.'
+for the PTRs of a reverse zone. Zones keep these as they are, rather than as the
+records they stand for, which are only built (one at a time) by records(). A
+range for a record type we don't keep, or using a modifier we don't know, is
+written back out as it was read but stands for no records. Attributes:
+    [ start stop step lhs ttl rrclass rr_type rhs text ]
+'text' is the line as read from the zone file, only kept when out() could not
+reproduce it. It must be set back to None if any of the others are changed.
+"""
+
+    # So the range can go through read_records() with the records
+    rrtype = '$GENERATE'
+    # The record types we build records for
+    rr_types = ('A', 'AAAA', 'CNAME', 'NS', 'PTR')
+
+    def __init__(self, start, stop, lhs, rr_type, rhs, ttl='', rrclass='IN', step=1):
+        self.start = start
+        self.stop = stop
+        self.step = step
+        self.lhs = lhs
+        self.ttl = ttl
+        self.rrclass = rrclass
+        self.rr_type = rr_type
+        self.rhs = rhs
+        self.text = None
+
+    def values(self):
+        "Return the counter values the range runs through."
+        
+        return xrange(self.start, self.stop + 1, self.step)
+
+    def records(self):
+        "Yield the records the range stands for, in counter order."
+        
+        if not self.rr_type in self.rr_types:
+            return
+        lhs = compile_template(self.lhs)
+        rhs = compile_template(self.rhs)
+        if lhs == None or rhs == None:
+            return
+        rr_class = record_classes[self.rr_type]
+        for value in self.values():
+            rr = rr_class.__new__(rr_class)
+            rr.src = expand_template(lhs, value)
+            rr.ttl = self.ttl
+            rr.rrclass = self.rrclass
+            rr.rrtype = self.rr_type
+            rr.tgt = expand_template(rhs, value)
+            rr.comment = ''
+            rr.text = None
+            yield rr
+
+    def key(self):
+        """Return what another range has to match to be merged with this one, or
+None if it can't be merged with anything (its step isn't 1, or its templates do
+more than put the counter in)."""
+        
+        if self.step != 1 or self.text != None or not self.rr_type in self.rr_types:
+            return None
+        for template in (self.lhs, self.rhs):
+            (before, counter, after) = template.partition('$')
+            if compile_template(template) != [part for part in (before, (0, '%d'), after) if part != '']:
+                return None
+        return (self.rr_type, self.lhs, self.rhs, self.ttl, self.rrclass)
+
+    def without(self, values):
+        """Return the list of ranges left once the counter values in values (a
+dictionary or set) are taken out of this one."""
+        
+        ranges = []
+        run = []
+        for value in list(self.values()) + [None]:
+            if value != None and not value in values:
+                run.append(value)
+            elif len(run) > 0:
+                ranges.append(GenerateRange(run[0], run[-1], self.lhs, self.rr_type,
+                                            self.rhs, self.ttl, self.rrclass, self.step))
+                run = []
+        return ranges
+
+    def out(self):
+        "Return the range as a $GENERATE line."
+        
+        if self.text != None:
+            return self.text
+        fields = ['$GENERATE', '%d-%d' % (self.start, self.stop)]
+        if self.step != 1:
+            fields[1] = fields[1] + '/%d' % self.step
+        fields.append(self.lhs)
+        if self.ttl != '':
+            fields.append(self.ttl)
+        fields.extend([self.rrclass, self.rr_type, self.rhs])
+        return ' '.join(fields)
+
+## END class GenerateRange
+
+class ZoneCache:
+    """Parsed zones, keyed by zone file, so that a zone file doesn't have to be
+read again until it changes. An entry is only used while its file has the same
+modification and change times, size and inode as when it was read; zone files we
+write are renamed into place, so always get a new inode. Files changed in the
+last settle_time seconds aren't cached at all, as on filesystems that only keep
+times to the second they could be changed again without their key changing.
+
+Zones are held in memory (at most max_zones of them, 0 for no limit, or none at
+all if max_zones is None), and if cache_dir is given they are also saved there,
+a marshal file per zone, so that later runs can use them. The files in
+cache_dir are kept to at most max_size bytes (0 for no limit). In both, the
+least recently used zones are dropped first.
+"""
+
+    # Changed whenever the saved form of a zone changes, so old files are ignored
+    version = 3
+    
+    # How long a zone file has to have gone unchanged before it is cached
+    settle_time = 2
+
+    def __init__(self, max_zones=0, cache_dir=None, max_size=0):
+        self.max_zones = max_zones
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        # Zone file -> (key, zone state), and zone file -> when it was last used
+        self.zones = {}
+        self.used = {}
+        self.uses = 0
+        self.hits = 0
+        self.misses = 0
+        # Bytes saved to cache_dir since it was last trimmed
+        self.written = 0
+        if cache_dir != None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, zone_file):
+        "Return what a zone file's entry is checked against, or None if there is no such file."
+        
+        return file_key(zone_file)
+
+    def cache_file(self, zone_file):
+        "Return the file in cache_dir that a zone file's entry is saved in."
+        
+        return os.path.join(self.cache_dir, hashlib.sha1(zone_file).hexdigest())
+
+    def get(self, zone_file, key):
+        "Return the state of a zone file, as Zone.get_state() gave it, or None."
+        
+        if key == None:
+            self.misses += 1
+            return None
+        entry = self.zones.get(zone_file)
+        if entry != None and entry[0] == key:
+            self.hits += 1
+            self.uses += 1
+            self.used[zone_file] = self.uses
+            return entry[1]
+        
+        if self.cache_dir != None:
+            cache_file = self.cache_file(zone_file)
+            try:
+                f = open(cache_file, 'rb')
+                entry = marshal.load(f)
+                f.close()
+            except (IOError, EOFError, ValueError, TypeError):
+                entry = None
+            if entry != None and entry[0] == self.version and entry[1] == key:
+                self.hits += 1
+                # The modification time of the file says when it was last used
+                try:
+                    os.utime(cache_file, None)
+                except OSError:
+                    pass
+                self.remember(zone_file, key, entry[2])
+                return entry[2]
+        self.misses += 1
+        return None
+
+    def put(self, zone_file, key, state):
+        "Remember the state of a zone file, read when the file matched key."
+        
+        if key == None or max(key[0], key[1]) > time.time() - self.settle_time:
+            return
+        self.remember(zone_file, key, state)
+        if self.cache_dir != None:
+            cache_file = self.cache_file(zone_file)
+            try:
+                (fd, tmp_file) = tempfile.mkstemp(dir=self.cache_dir, prefix='.')
+                f = os.fdopen(fd, 'wb')
+                marshal.dump((self.version, key, state), f)
+                self.written += f.tell()
+                f.close()
+                os.rename(tmp_file, cache_file)
+            except (IOError, OSError):
+                # We'll just have to read the zone file again next time
+                return
+            if self.max_size > 0 and self.written > self.max_size / 10:
+                self.trim()
+
+    def remember(self, zone_file, key, state):
+        "Hold the state of a zone file in memory, if we are holding any."
+        
+        if self.max_zones == None:
+            return
+        self.uses += 1
+        self.zones[zone_file] = (key, state)
+        self.used[zone_file] = self.uses
+        if self.max_zones > 0 and len(self.zones) > self.max_zones:
+            # Make some room, rather than sorting on every put
+            by_use = [(used, f) for (f, used) in self.used.items()]
+            by_use.sort()
+            for (used, f) in by_use[0:max(1, self.max_zones / 10)]:
+                del self.zones[f]
+                del self.used[f]
+
+    def forget(self, zone_file):
+        "Drop a zone file from the cache."
+        
+        if zone_file in self.zones:
+            del self.zones[zone_file]
+            del self.used[zone_file]
+        if self.cache_dir != None:
+            try:
+                os.remove(self.cache_file(zone_file))
+            except OSError:
+                pass
+
+    def trim(self):
+        """Remove the least recently used files from cache_dir until it is back
+under 90% of max_size."""
+        
+        self.written = 0
+        if self.cache_dir == None or self.max_size <= 0:
+            return
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            try:
+                st = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+            total += st.st_size
+        if total <= self.max_size:
+            return
+        files.sort()
+        for (mtime, name, size) in files:
+            if total <= self.max_size * 9 / 10:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                total -= size
+            except OSError:
+                pass
+
+    def close(self):
+        "Make sure cache_dir isn't left over max_size by the zones we have saved."
+        
+        if self.written > 0:
+            self.trim()
+
+## END class ZoneCache
+
+class IPIndex:
+    """Persistent index of the IP addresses used in each zone's A records.
+Lets us find the zones pointing at an IP without parsing every zone file.
+The index is kept in an sqlite database and can always be rebuilt from the
+zone files, so it is written without waiting for the disk.
+"""
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.db = sqlite3.connect(index_file)
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS a_records (ip TEXT, zone TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS a_records_ip ON a_records (ip)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS a_records_zone ON a_records (zone)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+
+    def is_built(self):
+        "Check whether the index has been fully built from the zone files."
+        
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row != None
+
+    def set_built(self):
+        "Mark the index as covering every zone file."
+        
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+        self.db.commit()
+
+    def clear(self):
+        "Empty the index, ready for a rebuild."
+        
+        self.db.execute('DELETE FROM a_records')
+        self.db.execute("DELETE FROM meta WHERE key = 'built'")
+        self.db.commit()
+
+    def lookup(self, ip):
+        "Return a sorted list of the names of zones with A records pointing to ip."
+        
+        rows = self.db.execute('SELECT DISTINCT zone FROM a_records WHERE ip = ? ORDER BY zone', (ip,))
+        return [str(row[0]) for row in rows]
+
+    def lookup_prefix(self, prefix):
+        """Return a sorted list of the names of zones with A records pointing to
+IPs starting with prefix (e.g. '10.1.2.')."""
+        
+        if prefix == '':
+            rows = self.db.execute('SELECT DISTINCT zone FROM a_records ORDER BY zone')
+        else:
+            # Everything starting with prefix sorts between prefix and the
+            # string with its last character bumped up by one
+            rows = self.db.execute('SELECT DISTINCT zone FROM a_records WHERE ip >= ? AND ip < ? ORDER BY zone',
+                                   (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)))
+        return [str(row[0]) for row in rows]
+
+    def zone_written(self, zone):
+        "Replace the index entries for zone with the IPs it now uses."
+        
+        self.index_zone(zone.name, zone.a_record_ips())
+
+    def soa_written(self, zone):
+        "Nothing to do, as the SOA has no IPs in it."
         
+        pass
 
-class ResourceRecord:
+    def index_zone(self, zone_name, ips):
+        "Replace the index entries for the zone called zone_name with the list ips."
+        
+        self.db.execute('DELETE FROM a_records WHERE zone = ?', (zone_name,))
+        self.db.executemany('INSERT INTO a_records (ip, zone) VALUES (?, ?)',
+                            [(ip, zone_name) for ip in ips])
+        self.db.commit()
+
+    def zone_removed(self, zone_name):
+        "Remove all index entries for the zone called zone_name."
+        
+        self.db.execute('DELETE FROM a_records WHERE zone = ?', (zone_name,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+## END class IPIndex
+
+class IPMap:
+    """A set of IP address changes, for ip-change to make in one pass over the
+zones. Changes are either of one address, or of a whole network (a CIDR rule,
+such as 10.1.2.0/24 -> 172.16.9.0/24) where each address keeps its host part.
+Single addresses are looked up in a dict. Networks are looked up with one dict
+per prefix length in use, longest first. Either way the cost doesn't grow with
+the number of changes. Each address is changed once, so changes can swap
+addresses around.
+"""
+
+    def __init__(self):
+        self.rules = []    # (old, new) as given, for showing to the user
+        self.exact = {}    # old address -> new address
+        self.networks = {} # prefix length -> {old network: new network} as ints
+        self.lengths = []  # the prefix lengths in networks, longest first
+
+    def add(self, old, new):
+        """Add a change from old to new, two addresses or two networks of the
+same size in CIDR notation. Raises ValueError if they aren't."""
+        
+        (old_net, old_len) = parse_cidr(old)
+        (new_net, new_len) = parse_cidr(new)
+        if old_len != new_len:
+            raise ValueError('%s and %s are not the same size' % (old, new))
+        if old_len == 32:
+            old = int_to_ip(old_net)
+            if old in self.exact and self.exact[old] != int_to_ip(new_net):
+                raise ValueError('%s is already being changed to %s' % (old, self.exact[old]))
+            self.exact[old] = int_to_ip(new_net)
+        else:
+            networks = self.networks.setdefault(old_len, {})
+            if old_net in networks and networks[old_net] != new_net:
+                raise ValueError('%s is already being changed to %s' % (old, int_to_ip(networks[old_net])))
+            networks[old_net] = new_net
+            self.lengths = sorted(self.networks.keys(), reverse=True)
+        self.rules.append((old, new))
+
+    def new_ip(self, ip):
+        "Return the address ip should be changed to, or None if it isn't being changed."
+        
+        new = self.exact.get(ip)
+        if new != None or len(self.lengths) == 0:
+            return new
+        try:
+            (address, length) = parse_cidr(ip)
+        except ValueError:
+            return None
+        if length != 32:
+            return None
+        for length in self.lengths:
+            host_bits = 32 - length
+            new_net = self.networks[length].get(address >> host_bits << host_bits)
+            if new_net != None:
+                return int_to_ip(new_net | (address & ((1 << host_bits) - 1)))
+        
+        return None
+
+    def __contains__(self, ip):
+        return self.new_ip(ip) != None
+
+    def __len__(self):
+        return len(self.rules)
+
+    def index_prefixes(self):
+        """Return the text prefixes that the addresses being changed start with,
+for finding them in an IPIndex. Single addresses are returned whole."""
+        
+        prefixes = self.exact.keys()
+        for length in self.lengths:
+            # Networks that don't end on a dot are split into the ones that do
+            octets = (length + 7) / 8
+            for old_net in self.networks[length].keys():
+                for x in range(1 << (octets * 8 - length)):
+                    net = old_net | (x << (32 - octets * 8))
+                    prefix = '.'.join(int_to_ip(net).split('.')[0:octets])
+                    if octets < 4:
+                        prefix = prefix + '.'
+                    prefixes.append(prefix.lstrip('.'))
+        
+        return prefixes
+
+## END class IPMap
+
+class RecordIndex:
+    """Persistent index of every record's name, type and target, across all of
+our zones, for the find command. Names (and the targets of records that point
+at a host) are kept fully qualified, in lower case and without the trailing
+dot, and a reversed copy of each is kept so that both prefix and suffix
+matches can use an sqlite index. Like the IP index, it can always be rebuilt
+from the zone files. The file_key() each zone was indexed from is kept too, so
+zones changed behind our back (e.g. edited by hand) can be found.
+"""
+
+    # Record types whose target is a host name, relative to the zone
+    host_targets = ('CNAME', 'MX', 'NS', 'PTR', 'SRV')
+
+    def __init__(self, index_file):
+        self.index_file = index_file
+        self.db = sqlite3.connect(index_file)
+        self.db.text_factory = str # TXT records can hold any bytes
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS records (zone TEXT, name TEXT, rname TEXT, type TEXT, target TEXT, rtarget TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_name ON records (name)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_rname ON records (rname)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_target ON records (target)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_rtarget ON records (rtarget)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS records_zone ON records (zone)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS zone_keys (zone TEXT PRIMARY KEY, key TEXT)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self.db.commit()
+
+    def is_built(self):
+        "Check whether the index has been fully built from the zone files."
+        
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()
+        return row != None
+
+    def set_built(self):
+        "Mark the index as covering every zone file."
+        
+        self.db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('built', '1')")
+        self.db.commit()
+
+    def clear(self):
+        "Empty the index, ready for a rebuild."
+        
+        self.db.execute('DELETE FROM records')
+        self.db.execute('DELETE FROM zone_keys')
+        self.db.execute("DELETE FROM meta WHERE key = 'built'")
+        self.db.commit()
+
+    def qualify(self, name, zone_name):
+        "Return name, relative to the zone called zone_name, in our index form."
+        
+        name = name.lower()
+        if name in ('', '@'):
+            name = zone_name
+        elif name[-1] != '.':
+            name = name + '.' + zone_name
+        
+        return name.rstrip('.')
+
+    def record_rows(self, zone_name, records):
+        "Yield the index rows for records (any iterable of records) in the zone called zone_name."
+        
+        for rr in records:
+            name = self.qualify(rr.src, zone_name)
+            if rr.rrtype in self.host_targets:
+                target = self.qualify(rr.tgt, zone_name)
+            else:
+                target = str(rr.tgt)
+            yield (zone_name, name, name[::-1], rr.rrtype, target, target[::-1])
+
+    def find(self, field, pattern, types=None, zone_name=None):
+        """Return a sorted list of (zone, name, type, target) tuples for the
+records whose field ('name' or 'target') matches pattern. A pattern ending in
+'*' matches by prefix, one starting with '*' matches by suffix, and anything
+else must match exactly. If types is given, only records of those types are
+returned, and if zone_name is given, only records in that zone. Zones are given
+in the same form as names, without the trailing dot."""
+        
+        pattern = pattern.lower()
+        if pattern.startswith('*'):
+            # A suffix of the name is a prefix of the reversed name
+            column = 'r' + field
+            prefix = pattern[1:].rstrip('.')[::-1]
+        elif pattern.endswith('*'):
+            column = field
+            prefix = pattern[:-1]
+        else:
+            column = field
+            prefix = None
+        
+        if prefix == None:
+            where = '%s = ?' % column
+            params = [pattern.rstrip('.')]
+        elif prefix == '':
+            where = '1'
+            params = []
+        elif prefix[-1] == '\xff':
+            where = '%s >= ? AND substr(%s, 1, ?) = ?' % (column, column)
+            params = [prefix, len(prefix), prefix]
+        else:
+            # Everything starting with prefix sorts between prefix and the
+            # string with its last character bumped up by one
+            where = '%s >= ? AND %s < ?' % (column, column)
+            params = [prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+        if types:
+            where = where + ' AND type IN (%s)' % ', '.join(['?'] * len(types))
+            params.extend([t.upper() for t in types])
+        if zone_name != None:
+            where = where + ' AND zone = ?'
+            params.append(zone_name.lower().rstrip('.') + '.')
+        
+        rows = self.db.execute('SELECT zone, name, type, target FROM records WHERE %s ORDER BY zone, name, type, target' % where, params)
+        return [(zone.rstrip('.'), name, rr_type, target) for (zone, name, rr_type, target) in rows]
+
+    def records_of_type(self, rr_type):
+        """Return a list of (zone, name, target) tuples for every record of type
+rr_type (e.g. 'A'), in any zone."""
+
+        rows = self.db.execute('SELECT zone, name, target FROM records WHERE type = ?', (rr_type.upper(),))
+        return rows.fetchall()
+
+    def zone_written(self, zone):
+        "Replace the index entries for zone with the records it now has."
+        
+        records = []
+        for list_name in zone.rr_list_names:
+            records.extend(zone.all_records(list_name))
+        self.index_zone(zone.name, records, zone.file_key)
+
+    def soa_written(self, zone):
+        """The SOA isn't indexed, so the records are left alone. So is the zone's
+file key, as the rest of the file wasn't read and could have been changed by
+hand before; the zone looks changed to stale_zones() until it is reindexed."""
+        
+        pass
+
+    def index_zone(self, zone_name, records, key=None):
+        """Replace the index entries for the zone called zone_name with records,
+which can be a generator (e.g. from Zone.iter_records()), as they are added to
+the index as they come. key is the file_key() of the zone file the records were
+read from (taken before it was read)."""
+        
+        self.db.execute('DELETE FROM records WHERE zone = ?', (zone_name,))
+        self.db.executemany('INSERT INTO records (zone, name, rname, type, target, rtarget) VALUES (?, ?, ?, ?, ?, ?)',
+                            self.record_rows(zone_name, records))
+        self.db.execute('INSERT OR REPLACE INTO zone_keys (zone, key) VALUES (?, ?)',
+                        (zone_name, key and repr(key)))
+        self.db.commit()
+
+    def stale_zones(self, zones):
+        """Return the (zone name, zone file) tuples in zones whose zone file isn't
+the one the zone was indexed from, or that weren't indexed at all."""
+        
+        keys = dict(self.db.execute('SELECT zone, key FROM zone_keys'))
+        stale = []
+        for (zone_name, zone_file) in zones:
+            key = file_key(zone_file)
+            if key == None or keys.get(zone_name) != repr(key):
+                stale.append((zone_name, zone_file))
+        return stale
+
+    def zone_removed(self, zone_name):
+        "Remove all index entries for the zone called zone_name."
+        
+        self.db.execute('DELETE FROM records WHERE zone = ?', (zone_name,))
+        self.db.execute('DELETE FROM zone_keys WHERE zone = ?', (zone_name,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+## END class RecordIndex
+
+class ZoneManifest:
+    """Serial numbers and content hashes of our zone files, used to compare our
+zones with another nameserver's. The hashes are cached in an sqlite database
+against each file's size and modification time, so only zone files that have
+changed since we last looked need to be read.
+"""
+
+    def __init__(self, manifest_file):
+        self.manifest_file = manifest_file
+        self.db = sqlite3.connect(manifest_file)
+        self.db.execute('PRAGMA synchronous = OFF')
+        self.db.execute('CREATE TABLE IF NOT EXISTS zones (zone TEXT PRIMARY KEY, '
+                        'mtime REAL, size INTEGER, serial TEXT, hash TEXT)')
+        self.db.commit()
+
+    def entry(self, zone_name, zone_file):
+        """Return a (serial, hash) tuple for a zone file, or None if there is no
+such file. The serial is '-' if it can't be found in the file."""
+        
+        try:
+            st = os.stat(zone_file)
+        except OSError:
+            return None
+        row = self.db.execute('SELECT mtime, size, serial, hash FROM zones WHERE zone = ?',
+                              (zone_name,)).fetchone()
+        if row != None and row[0] == st.st_mtime and row[1] == st.st_size:
+            return (str(row[2]), str(row[3]))
+        
+        f = open(zone_file, 'r')
+        contents = f.read()
+        f.close()
+        serial = serial_of(contents)
+        digest = hashlib.sha1(contents).hexdigest()
+        self.db.execute('INSERT OR REPLACE INTO zones (zone, mtime, size, serial, hash) '
+                        'VALUES (?, ?, ?, ?, ?)', (zone_name, st.st_mtime, st.st_size, serial, digest))
+        return (serial, digest)
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+## END class ZoneManifest
+
+class ZoneJournal:
+    """Journal of the changes made to each zone, kept as a file per zone in
+journal_dir. Every time a zone file is rewritten an entry is added holding the
+old and new serials, hashes of the old and new files, and the lines removed from
+and added to the file (see diff_lines()). A nameserver holding the old file can
+be brought up to date with these entries instead of the whole new file. Once a
+journal file grows past max_size its oldest entries are dropped.
+"""
+
+    def __init__(self, journal_dir, max_size=1048576):
+        self.journal_dir = journal_dir
+        self.max_size = max_size
+
+    def journal_file(self, zone_name):
+        "Return the path to a zone's journal file."
+        
+        return os.path.join(self.journal_dir, zone_name + 'jnl')
+
+    def record(self, zone_name, old_contents, new_contents):
+        "Add an entry for a zone file changing from old_contents to new_contents."
+        
+        old_lines = old_contents.split('\n')
+        new_lines = new_contents.split('\n')
+        (removed, added) = diff_lines(old_lines, new_lines)
+        if patch_lines(old_lines, removed, added) != new_lines:
+            removed = added = None
+        self.record_diff(zone_name, serial_of(old_contents), serial_of(new_contents),
+                         hashlib.sha1(old_contents).hexdigest(),
+                         hashlib.sha1(new_contents).hexdigest(), removed, added)
+
+    def record_diff(self, zone_name, old_serial, new_serial, old_hash, new_hash, removed, added):
+        """Add an entry for a change that the caller has already worked out, for
+when the whole old and new files aren't at hand. removed and added are as from
+diff_lines(), or None if the change can't be replayed from a diff."""
+
+        header = [old_serial, new_serial, str(int(time.time())), old_hash, new_hash]
+        entry = []
+        if removed != None:
+            entry.append('@ ' + ' '.join(header) + ' %d %d' % (len(removed), len(added)))
+            for line in removed:
+                entry.append('-' + line)
+            for (x, line) in added:
+                entry.append('+%d %s' % (x, line))
+        else:
+            # The change can't be replayed from a diff, so anyone with the old
+            # file will need the whole new one.
+            entry.append('@ ' + ' '.join(header) + ' full')
+        self.append(zone_name, '\n'.join(entry) + '\n')
+
+    def append(self, zone_name, entry_text):
+        "Add entries (as text, in our journal format) to a zone's journal."
+        
+        if not os.path.isdir(self.journal_dir):
+            os.makedirs(self.journal_dir)
+        journal_file = self.journal_file(zone_name)
+        f = open(journal_file, 'a')
+        f.write(entry_text)
+        f.close()
+        if os.path.getsize(journal_file) > self.max_size:
+            self.trim(zone_name)
+
+    def trim(self, zone_name):
+        "Drop a zone's oldest journal entries, until it is under half of max_size."
+        
+        entries = self.entries(zone_name)
+        size = 0
+        keep = []
+        for entry in reversed(entries):
+            size += len(entry['text'])
+            if size > self.max_size / 2 and len(keep) > 0:
+                break
+            keep.insert(0, entry['text'])
+        tmp_file = self.journal_file(zone_name) + '.tmp'
+        f = open(tmp_file, 'w')
+        f.write(''.join(keep))
+        f.close()
+        os.rename(tmp_file, self.journal_file(zone_name))
+
+    def entries(self, zone_name):
+        "Read a zone's journal, returning a list of entries (see parse_journal()), oldest first."
+        
+        try:
+            f = open(self.journal_file(zone_name), 'r')
+        except IOError:
+            return []
+        entries = parse_journal(f)
+        f.close()
+        return entries
+
+    def entries_between(self, zone_name, from_hash, to_hash):
+        """Return the journal entries that take a zone file with hash from_hash to
+the one with hash to_hash, or None if the journal can't do that."""
+        
+        entries = self.entries(zone_name)
+        for x in range(len(entries)):
+            if entries[x]['old_hash'] == from_hash:
+                chain = entries[x:]
+                break
+        else:
+            return None
+        prev_hash = from_hash
+        for entry in chain:
+            if entry['full'] or entry['old_hash'] != prev_hash:
+                return None
+            prev_hash = entry['new_hash']
+            if prev_hash == to_hash:
+                return chain[:chain.index(entry)+1]
+        return None
+
+    def remove(self, zone_name):
+        "Remove a zone's journal."
+        
+        try:
+            os.remove(self.journal_file(zone_name))
+        except OSError:
+            pass
+
+## END class ZoneJournal
+
+class ReloadTracker:
+    """Keeps track of the zones changed during a run, so that just those zones
+need reloading at the end of it. Used as a zone hook. full_reload is set when a
+change needs all of named's config reloaded, such as a zone being added to or
+removed from named.conf.
+"""
+
+    def __init__(self):
+        self.zones = []
+        self.full_reload = False
+
+    def zone_written(self, zone):
+        "Note that zone has changed."
+        
+        if not zone.name in self.zones:
+            self.zones.append(zone.name)
+
+    def soa_written(self, zone):
+        "A new serial or TTL needs a reload like any other change."
+        
+        self.zone_written(zone)
+
+    def zone_removed(self, zone_name):
+        "A removed zone can only be dropped by reloading named's config."
+        
+        self.full_reload = True
+
+    def changed(self):
+        "Check whether anything has changed, so we need to reload at all."
+        
+        return self.full_reload or len(self.zones) > 0
+
+## END class ReloadTracker
+
+class ZoneLocks:
+    """Locks on zones, and on named.conf, shared with any other dnsadmin
+processes through fcntl locks on files in lock_dir. Zone locks are taken before
+a zone is read to be changed and held until release_all() (or we exit). The
+named.conf lock is only held while entries are being added or removed. Locks
+are taken in a fixed order to avoid deadlocks: zones sorted by name, then
+named.conf. Waiting for a lock gives up after timeout seconds with an IOError.
+"""
+
+    # The lock for named.conf (and the managed include files). Zone names can't
+    # start with '.', so this can't clash with a zone's lock.
+    conf_lock = '.named.conf'
+
+    def __init__(self, lock_dir, timeout=30):
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self.held = {} # lock name -> file descriptor
+        if not os.path.isdir(lock_dir):
+            os.makedirs(lock_dir, 0700)
+
+    def acquire(self, name):
+        "Take the lock called name, waiting up to timeout seconds for it."
+        
+        if name in self.held:
+            return
+        started = time.time()
+        fd = os.open(os.path.join(self.lock_dir, name.rstrip('.').replace('/', '_') + '.lock'),
+                     os.O_RDWR | os.O_CREAT, 0600)
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError, e:
+                if not e.errno in (errno.EAGAIN, errno.EACCES) \
+                   or time.time() - started >= self.timeout:
+                    os.close(fd)
+                    raise IOError('Timed out waiting for the lock on %s' % name)
+                time.sleep(0.05)
+        self.held[name] = fd
+        timings.add('lock', time.time() - started)
+
+    def release(self, name):
+        "Give up the lock called name, if we hold it."
+        
+        fd = self.held.pop(name, None)
+        if fd != None:
+            # Unlock explicitly, as worker processes may share the descriptor
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def lock_zones(self, zone_names):
+        "Lock each of the zones called zone_names, in order."
+        
+        for zone_name in sorted(zone_names):
+            self.acquire(zone_name)
+
+    def lock_conf(self):
+        "Lock named.conf, while we add or remove zone entries."
+        
+        self.acquire(self.conf_lock)
+
+    def unlock_conf(self):
+        self.release(self.conf_lock)
+
+    def release_all(self):
+        "Give up every lock we hold."
+        
+        for name in self.held.keys():
+            self.release(name)
+
+## END class ZoneLocks
+
+class Timings:
+    """Wall time, number of calls and bytes handled for each phase of a command
+(parsing, writing, named.conf changes, remote steps, etc.), and how long each of
+our other nameservers took over each remote step. Phases can overlap, e.g. a
+zone file is parsed during the 'scan' of an ip-change. Nothing is recorded
+unless enabled is set, so the calls can be left in place.
+"""
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        "Forget everything recorded so far."
+        
+        # Phase -> [calls, seconds, bytes]
+        self.phases = {}
+        # Host -> list of (step description, seconds, exit status) tuples
+        self.hosts = {}
+        self.started = time.time()
+
+    def add(self, phase, seconds, nbytes=0, calls=1):
+        "Record a call to phase that took seconds and handled nbytes bytes."
+        
+        if not self.enabled:
+            return
+        entry = self.phases.get(phase)
+        if entry == None:
+            self.phases[phase] = [calls, seconds, nbytes]
+        else:
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += nbytes
+
+    def host_step(self, host, description, seconds, status):
+        "Record a remote step run on one of our other nameservers."
+        
+        if not self.enabled:
+            return
+        if not host in self.hosts:
+            self.hosts[host] = []
+        self.hosts[host].append((description, seconds, status))
+
+    def take(self):
+        """Return what has been recorded so far (for merge() to add to another
+Timings, e.g. in the parent of a worker process), and start again."""
+        
+        taken = (self.phases, self.hosts)
+        self.reset()
+        return taken
+
+    def merge(self, taken):
+        "Add what another Timings's take() returned to ours."
+        
+        (phases, hosts) = taken
+        for (phase, (calls, seconds, nbytes)) in phases.items():
+            self.add(phase, seconds, nbytes, calls)
+        for (host, steps) in hosts.items():
+            for (description, seconds, status) in steps:
+                self.host_step(host, description, seconds, status)
+
+    def summary(self):
+        "Return a table of the phases and remote steps, for printing."
+        
+        lines = ['%-12s %8s %10s %12s' % ('phase', 'calls', 'seconds', 'bytes')]
+        phase_names = self.phases.keys()
+        phase_names.sort()
+        for phase in phase_names:
+            (calls, seconds, nbytes) = self.phases[phase]
+            lines.append('%-12s %8d %10.3f %12d' % (phase, calls, seconds, nbytes))
+        lines.append('%-12s %8s %10.3f' % ('total', '', time.time() - self.started))
+        host_names = self.hosts.keys()
+        host_names.sort()
+        for host in host_names:
+            lines.append('%s:' % host)
+            for (description, seconds, status) in self.hosts[host]:
+                lines.append('  %8.3fs  exit %-3d %s' % (seconds, status, description))
+        
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        "Return the phases and remote steps as a dictionary, e.g. to save as JSON."
+        
+        phases = {}
+        for (phase, (calls, seconds, nbytes)) in self.phases.items():
+            phases[phase] = {'calls': calls, 'seconds': round(seconds, 6), 'bytes': nbytes}
+        hosts = {}
+        for (host, steps) in self.hosts.items():
+            hosts[host] = [{'step': description, 'seconds': round(seconds, 6), 'status': status}
+                           for (description, seconds, status) in steps]
+        
+        return {'total': round(time.time() - self.started, 6), 'phases': phases, 'hosts': hosts}
+
+## END class Timings
+
+# Everything we time goes in here; dnsadmin turns it on for --timings
+timings = Timings()
+
+class ManagedConf:
+    """Zone entries for named.conf, kept in a fixed set of shard files instead of
+one big file. named.conf includes a single file (zones.conf) which includes
+every shard, and each zone's entry lives in the shard its name hashes to. A
+manifest of zone names and shards is kept in an sqlite database alongside, so
+finding, adding and removing a zone only touches that zone's shard. If named
+runs chrooted, chroot is the directory it is chrooted to, and is taken off the
+front of the paths in the include lines. Zones with an entry in named.conf itself
+(conf_path), as they all have until conf-migrate is run, are never given another.
+"""
+
+    def __init__(self, conf_dir, shards=64, chroot='', conf_path=None):
+        self.conf_dir = conf_dir
+        self.conf_path = conf_path
+        self.chroot = chroot.rstrip(os.sep)
+        if not os.path.isdir(conf_dir):
+            os.makedirs(conf_dir)
+        self.db = sqlite3.connect(os.path.join(conf_dir, 'manifest.db'))
+        self.db.execute('CREATE TABLE IF NOT EXISTS zones (zone TEXT PRIMARY KEY, shard INTEGER)')
+        self.db.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        # The shard count can't change once zones have been placed, so the one
+        # we were first set up with wins.
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'shards'").fetchone()
+        if row == None:
+            self.db.execute("INSERT INTO meta (key, value) VALUES ('shards', ?)", (str(shards),))
+            self.shards = shards
+        else:
+            self.shards = int(row[0])
+        self.db.commit()
+        self.include_file = os.path.join(conf_dir, 'zones.conf')
+        self.write_include_file()
+
+    def shard_file(self, shard):
+        "Return the path to a shard file."
+        
+        return os.path.join(self.conf_dir, 'zones-%03d.conf' % shard)
+
+    def shard_for(self, zone_name):
+        "Work out which shard a zone's entry belongs in."
+        
+        return int(hashlib.md5(zone_name).hexdigest()[:8], 16) % self.shards
+
+    def named_path(self, path):
+        "Return path as named sees it, inside its chroot."
+        
+        if self.chroot != '' and path.startswith(self.chroot + os.sep):
+            return path[len(self.chroot):]
+        return path
+
+    def write_include_file(self):
+        """Create any missing shard files, and the file that includes them all (as
+named fails to start if an included file is missing). The include file is only
+written if it doesn't already hold what it should (e.g. after chroot changes)."""
+        
+        lines = []
+        for shard in range(self.shards):
+            if not os.path.isfile(self.shard_file(shard)):
+                open(self.shard_file(shard), 'a').close()
+            lines.append('include "%s";\n' % self.named_path(self.shard_file(shard)))
+        try:
+            f = open(self.include_file, 'r')
+            if f.read() == ''.join(lines):
+                f.close()
+                return
+            f.close()
+        except IOError:
+            pass
+        f = open(self.include_file, 'w')
+        f.write(''.join(lines))
+        f.close()
+
+    def has_zone(self, zone_name):
+        "Check whether there is an entry for zone_name."
+        
+        row = self.db.execute('SELECT shard FROM zones WHERE zone = ?',
+                              (zone_name.rstrip('.'),)).fetchone()
+        return row != None
+
+    def conf_zone_names(self):
+        """Return a dictionary of the zones (without trailing '.') that have an entry
+in named.conf itself, rather than in our shards."""
+        
+        if self.conf_path == None:
+            return {}
+        try:
+            f = open(self.conf_path, 'r')
+        except IOError:
+            return {}
+        names = re.findall(r'\bzone\s+"([^"]+)"', f.read())
+        f.close()
+        return dict([(zone_name.rstrip('.'), True) for zone_name in names])
+
+    def zone_names(self):
+        "Return a sorted list of the zones we have entries for (without trailing '.')."
+        
+        rows = self.db.execute('SELECT zone FROM zones ORDER BY zone')
+        return [str(row[0]) for row in rows]
+
+    def add_zone(self, zone_name, conf_entry):
+        """Add conf_entry for zone_name to its shard. Returns False, and changes
+nothing, if the zone already has an entry."""
+        
+        return self.add_zones([(zone_name, conf_entry)]) != []
+
+    def add_zones(self, entries, conf_names=None):
+        """Add a list of (zone name, conf entry) tuples to their shards, writing to
+each shard once. Zones that already have an entry are skipped. conf_names is a
+dictionary of the zones with an entry in named.conf, as from conf_zone_names(),
+which is read once for the whole list if not given (conf-migrate passes an empty
+one, as it is moving those entries). Returns the list of zone names (without
+trailing '.') that were added."""
+        
+        by_shard = {}
+        added = []
+        if conf_names == None:
+            conf_names = self.conf_zone_names()
+        seen = conf_names.copy()
+        for (zone_name, conf_entry) in entries:
+            zone_name = zone_name.rstrip('.')
+            if zone_name in seen or self.has_zone(zone_name):
+                continue
+            seen[zone_name] = True
+            shard = self.shard_for(zone_name)
+            if not shard in by_shard:
+                by_shard[shard] = []
+            by_shard[shard].append(conf_entry + '\n')
+            added.append(zone_name)
+        for (shard, lines) in by_shard.items():
+            f = open(self.shard_file(shard), 'a')
+            f.write(''.join(lines))
+            f.close()
+        self.db.executemany('INSERT INTO zones (zone, shard) VALUES (?, ?)',
+                            [(zone_name, self.shard_for(zone_name)) for zone_name in added])
+        self.db.commit()
+        return added
+
+    def remove_zone(self, zone_name):
+        """Remove the entry for zone_name from its shard. Returns False if there
+was no entry to remove."""
+        
+        zone_name = zone_name.rstrip('.')
+        row = self.db.execute('SELECT shard FROM zones WHERE zone = ?', (zone_name,)).fetchone()
+        if row == None:
+            return False
+        shard_file = self.shard_file(row[0])
+        zone_block_start = re.compile(r'\s*zone\b\s+"' + re.escape(zone_name) + r'"')
+        f = open(shard_file, 'r')
+        lines = []
+        depth = 0 # brace depth inside our zone's block
+        for line in f:
+            if depth > 0:
+                depth += line.count('{') - line.count('}')
+            elif zone_block_start.match(line):
+                depth = line.count('{') - line.count('}')
+            else:
+                lines.append(line)
+        f.close()
+        (fd, tmp_file) = tempfile.mkstemp(dir=self.conf_dir, prefix='.zones.')
+        f = os.fdopen(fd, 'w')
+        f.write(''.join(lines))
+        f.close()
+        os.chmod(tmp_file, 0644)
+        os.rename(tmp_file, shard_file)
+        self.db.execute('DELETE FROM zones WHERE zone = ?', (zone_name,))
+        self.db.commit()
+        return True
+
+    def close(self):
+        self.db.close()
+
+## END class ManagedConf
+
+class Replicator:
+    """Runs commands on, and sends files to, our peer nameservers. Every peer is
+worked on at the same time (or up to parallelism peers at a time), so a change
+takes as long to go out as the slowest peer rather than all of them added up.
+The steps for one peer are run in order, and a failed step stops the rest of
+that peer's steps. If control_dir is given, ssh keeps a master connection open
+to each peer there, which all of our later ssh calls share.
+"""
+
+    def __init__(self, nameservers, ssh_command='ssh', parallelism=0,
+                 control_dir=None, verbose=False):
+        self.nameservers = nameservers
+        self.ssh_command = shlex.split(ssh_command)
+        self.parallelism = parallelism
+        self.verbose = verbose
+        self.ssh_options = []
+        if control_dir != None:
+            self.ssh_options = ['-o', 'ControlMaster=auto',
+                                '-o', 'ControlPath=%s' % os.path.join(control_dir, '%r@%h:%p'),
+                                '-o', 'ControlPersist=60']
+        # Each peer's steps so far, as (host, description, exit status) tuples
+        self.results = []
+        # Output of the last query() or send() step on each peer
+        self.output = {}
+
+    def ssh_step(self, host, command, input_file=None, kind='ssh'):
+        """Return a step that runs command on host, with the contents of
+input_file (if given) as its standard input."""
+        
+        return (kind, self.ssh_command + self.ssh_options + [host, command], command, input_file)
+
+    def run(self, command, msg=None):
+        """Run command on every peer. msg is printed for each peer in verbose
+mode, with %s replaced by the peer's name. Returns True if it worked on all of
+them."""
+        
+        host_steps = {}
+        for host in self.nameservers:
+            host_steps[host] = [self.ssh_step(host, command)]
+        return self.fan_out(host_steps, msg)
+
+    def query(self, command, msg=None):
+        """Run command on every peer, returning a dictionary of the output from
+each peer it worked on."""
+        
+        host_steps = {}
+        for host in self.nameservers:
+            host_steps[host] = [self.ssh_step(host, command, kind='query')]
+        self.output = {}
+        self.fan_out(host_steps, msg)
+        return self.output
+
+    def send(self, host_files, command, msg=None):
+        """Run command on each peer in the host_files dictionary, feeding it the
+contents of that peer's file. Returns a dictionary of the output from each peer,
+whether it worked or not."""
+        
+        host_steps = {}
+        for host in host_files.keys():
+            host_steps[host] = [self.ssh_step(host, command, host_files[host], kind='send')]
+        self.output = {}
+        self.fan_out(host_steps, msg)
+        return self.output
+
+    def fan_out(self, host_steps, msg=None):
+        """Run the steps in host_steps (a dictionary of lists of steps, keyed on
+peer name) on all peers at once. Output from a step is held back until it
+finishes, so output from different peers doesn't get mixed up. Returns True if
+every step worked."""
+        
+        started = time.time()
+        waiting = [host for host in self.nameservers if host in host_steps]
+        limit = self.parallelism
+        if limit < 1:
+            limit = len(waiting)
+        running = []
+        all_ok = True
+        while len(waiting) > 0 or len(running) > 0:
+            # Start on more peers if we have room
+            while len(waiting) > 0 and len(running) < limit:
+                host = waiting.pop(0)
+                if self.verbose and msg != None:
+                    print msg % host
+                running.append(self.start_step(host, host_steps[host]))
+            time.sleep(0.01)
+            for job in running[:]:
+                (host, steps, proc, output, step_started) = job
+                status = proc.poll()
+                if status == None:
+                    continue
+                running.remove(job)
+                (kind, argv, description, input_file) = steps[0]
+                timings.host_step(host, description, time.time() - step_started, status)
+                output.seek(0)
+                text = output.read()
+                output.close()
+                if kind == 'query':
+                    # The output is for our caller, not the user
+                    if status == 0:
+                        self.output[host] = text
+                elif kind == 'send':
+                    self.output[host] = text
+                elif text != '':
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                self.results.append((host, description, status))
+                if status != 0:
+                    all_ok = False
+                elif len(steps) > 1:
+                    running.append(self.start_step(host, steps[1:]))
+        timings.add('remote', time.time() - started)
+        
+        return all_ok
+
+    def start_step(self, host, steps):
+        "Start the first of a peer's steps, returning a job for fan_out() to follow."
+        
+        (kind, argv, description, input_file) = steps[0]
+        output = tempfile.TemporaryFile()
+        if input_file != None:
+            step_input = open(input_file, 'rb')
+        else:
+            step_input = open(os.devnull, 'r')
+        if kind == 'query':
+            # Keep errors out of the output we are going to read
+            proc = subprocess.Popen(argv, stdin=step_input, stdout=output)
+        else:
+            proc = subprocess.Popen(argv, stdin=step_input, stdout=output,
+                                    stderr=subprocess.STDOUT)
+        step_input.close()
+        return (host, steps, proc, output, time.time())
+
+    def failed_hosts(self):
+        "Return a list of the peers that any step failed on."
+        
+        failed = []
+        for (host, step, status) in self.results:
+            if status != 0 and not host in failed:
+                failed.append(host)
+        return failed
+
+    def summary(self):
+        "Return a summary of how each peer got on, a line per peer."
+        
+        lines = []
+        for host in self.nameservers:
+            steps = 0
+            errors = []
+            for (result_host, step, status) in self.results:
+                if result_host == host:
+                    steps += 1
+                    if status != 0:
+                        errors.append("'%s' exited with status %d" % (step, status))
+            if steps == 0:
+                continue
+            if len(errors) == 0:
+                lines.append("  %s: OK (%d steps)" % (host, steps))
+            else:
+                lines.append("  %s: FAILED, %s" % (host, '; '.join(errors)))
+        return '\n'.join(lines)
+
+## END class Replicator
+
+class ResourceRecord(object):
     """A basic resource record superclass. Attributes:
-    [ src ttl rrclass rrtype tgt comment ]
+    [ src ttl rrclass rrtype tgt comment text ]
     'src' is the terminology for the hostname, the source.
     'tgt' is the terminology for the target address.
+    'text' is the record as read from a zone file, only kept when out() could
+    not reproduce it from the other attributes. It must be set back to None if
+    any of them are changed.
+    Records use __slots__, as large zones hold a lot of them; subclasses need to
+    declare __slots__ for any attributes they add.
     """
 
+    __slots__ = ('src', 'ttl', 'rrclass', 'rrtype', 'tgt', 'comment', 'text')
     spaceReplace = '_'  # this can be used to replace spaces when necessary.
 
     def __init__( self ):
@@ -341,6 +2545,7 @@ class ResourceRecord:
         self.rrtype = ''
         self.tgt = ''
         self.comment = ''
+        self.text = None
 
 
     def getSrc( self ):
@@ -443,6 +2648,8 @@ class ResourceRecord:
     def out( self ):
         "Returns the attributes as a resource record formatted string."
         
+        if self.text != None:
+            return self.text
         rrstring = self.getSrc() + '\t' + self.getTtl() + '\t' + self.getRrclass() + ' ' + self.getRrtype() + '\t' + self.getTgt() + ' ' + self.getComment()
         
         return rrstring
@@ -451,6 +2658,7 @@ class ResourceRecord:
 
 class A(ResourceRecord):
     "'A' resource record definition. attributes: [ src ttl rrclass rrtype='A' tgt ]"
+    __slots__ = ()
     
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -487,6 +2695,7 @@ class A(ResourceRecord):
 
 class AAAA(ResourceRecord):
     "'AAAA' IPv6 resource record definition. attributes [ src ttl rrclass rrtype='AAAA' tgt ]"
+    __slots__ = ()
 
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -519,6 +2728,7 @@ class AAAA(ResourceRecord):
 
 class CNAME(ResourceRecord):
     "'CNAME' resource record definition. attributes: [ src ttl rrclass rrtype='CNAME' tgt ]"
+    __slots__ = ()
     
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -528,6 +2738,7 @@ class CNAME(ResourceRecord):
 
 class HINFO(ResourceRecord):
     "'HINFO' resource record definition. attributes: [ src ttl rrclass rrtype='HINFO' cpu os ]"
+    __slots__ = ('cpu', 'os')
     
     def __init__(self):
         ResourceRecord.__init__(self)
@@ -559,8 +2770,10 @@ class HINFO(ResourceRecord):
     def out(self):
         "Returns the resource record as a string. Modified for HINFO, as tgt does not apply."
         
-        rrstring = self.getSrc() + ' ' + self.getTtl() + '\t' + self.getRrclass() + ' ' + self.getRrtype() + sp
-        rrstring = rrstring + self.getCpu + ' ' + self.getOs() + ' ' + self.getComment()
+        if self.text != None:
+            return self.text
+        rrstring = self.getSrc() + '\t' + self.getTtl() + '\t' + self.getRrclass() + ' ' + self.getRrtype() + '\t'
+        rrstring = rrstring + self.getCpu() + ' ' + self.getOs() + ' ' + self.getComment()
                     
         return rrstring
 
@@ -568,6 +2781,7 @@ class HINFO(ResourceRecord):
 
 class MX ( ResourceRecord ):
     "'MX' resource record definition. attributes: [ src ttl rrclass rrtype='MX' pref tgt ]"
+    __slots__ = ('pref',)
     
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -591,6 +2805,8 @@ class MX ( ResourceRecord ):
     def out( self ):
         "Returns the resource record as a string. Modified for MX, as pref also needs to be displayed."
         
+        if self.text != None:
+            return self.text
         rrstring = self.getSrc() + '\t' + self.getTtl() + '\t' + self.getRrclass() + ' ' + self.getRrtype() + '\t'
         rrstring = rrstring + self.getPref() + ' ' + self.getTgt() + ' ' + self.getComment()
         
@@ -600,6 +2816,7 @@ class MX ( ResourceRecord ):
 
 class NS ( ResourceRecord ):
     "'NS' resource record definition. attributes: [src ttl rrclass rrtype='NS' target]"
+    __slots__ = ()
     
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -609,6 +2826,7 @@ class NS ( ResourceRecord ):
 
 class PTR ( ResourceRecord ):
     "'PTR' resource record definition. attributes: [ src ttl rrclass rrtype='PTR' target ]"
+    __slots__ = ()
     
     def __init__( self ):
         ResourceRecord.__init__( self )
@@ -634,6 +2852,7 @@ class PTR ( ResourceRecord ):
 
 class SRV ( ResourceRecord ):
     "'SRV' resource record definition. attributes: [src ttl rrclass rrtype='SRV' priority weight port target]"
+    __slots__ = ('priority', 'weight', 'port')
     
     def __init__(self):
         ResourceRecord.__init__(self)
@@ -677,8 +2896,10 @@ class SRV ( ResourceRecord ):
 
     def out(self):
         "Returns the SRV resource record as a string."
+        if self.text != None:
+            return self.text
         rrstring = self.getSrc() + '\t' + self.getTtl() + '\t' + self.getRrclass() + ' ' + self.getRrtype() + '\t'
-        rrstring = rrstring + self.getPriority() + ' ' + self.getWeight() + ' ' + self.getPort() + ''
+        rrstring = rrstring + str(self.getPriority()) + ' ' + str(self.getWeight()) + ' ' + self.getPort() + ' '
         rrstring = rrstring + self.getTgt() + ' ' + self.getComment()
         return rrstring
 
@@ -686,6 +2907,7 @@ class SRV ( ResourceRecord ):
 
 class TXT ( ResourceRecord ):
     "'TXT' resource record definition. attributes: [src ttl rrclass rrtype='TXT' txt-strings]"
+    __slots__ = ()
     def __init__(self):
         ResourceRecord.__init__(self)
         self.rrtype = 'TXT'
@@ -700,3 +2922,11 @@ class TXT ( ResourceRecord ):
 
 #class WKS ( ResourceRecord ):
 ## END class WKS
+
+# The record class for each record type a Zone keeps
+record_classes = {
+    'A':A, 'AAAA':AAAA, 'CNAME':CNAME, 'HINFO':HINFO, 'MX':MX, 'NS':NS,
+    'PTR':PTR, 'SRV':SRV, 'TXT':TXT
+}
+# Filled in by record_slots()
+record_slot_cache = {}